@@ -1,5 +1,6 @@
 import streamlit as st
 import logging
+import pandas as pd
 
 from utils.streamlit_helpers import render_reset, render_reset_data_analyst, render_session_state, setup_session_state, render_reset_analytics_agent
 from widgets.home import setup_home, render_home
@@ -14,6 +15,11 @@ st.set_page_config(
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# With Copy-on-Write, shallow copies of the vetted dataframes share memory with the
+# master copy until sandboxed code modifies them, at which point only the modified
+# columns are copied. This lets every tool call see the data without a deep copy.
+pd.set_option('mode.copy_on_write', True)
+
 if 'session_id' not in st.session_state.keys():
     st.session_state.update(setup_session_state())
 
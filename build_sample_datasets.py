@@ -0,0 +1,12 @@
+import logging
+
+from utils.data_import_helpers import build_sample_dataset, datasets, SAMPLE_DATASETS_DIR
+
+# Prebuilds the sample datasets so the app can serve them without network access.
+# Run this wherever the seaborn sample data can be downloaded, e.g. during the Docker build.
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+for filename in datasets:
+    build_sample_dataset(filename)
+    logging.info(f'Built sample dataset {filename} in {SAMPLE_DATASETS_DIR}')
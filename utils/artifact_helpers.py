@@ -0,0 +1,183 @@
+import os
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Tool results refer to stored artifacts with this prefix instead of carrying the bytes
+ARTIFACT_PREFIX = 'artifact://'
+
+# Memory budget for artifacts, least recently used ones spill to disk beyond it
+ARTIFACT_MEMORY_BUDGET = 64 * 1024 * 1024  # 64MB
+
+# Disk budget for spilled artifacts, least recently used ones are deleted beyond it
+ARTIFACT_DISK_BUDGET = 1024 * 1024 * 1024  # 1GB
+
+# Directory holding the spilled artifacts
+ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), 'arctic_analytics', 'artifacts')
+
+# Images are only sent to the model for this many of the most recent user turns
+ARTIFACT_KEEP_TURNS = 1
+
+# Sent in place of images the model no longer needs
+OMITTED_ARTIFACT_TEXT = 'Plot from an earlier turn omitted, it was shown to the user.'
+
+
+class ArtifactStore:
+    """
+    Process-wide, content-addressed store of binary tool results such as plots.
+
+    Messages hold an artifact reference instead of a base64 data URL, so the
+    bytes are kept once however often the conversation is re-rendered or resent.
+    Artifacts live in memory and spill to disk once the memory budget is exceeded.
+    An artifact can name a larger version of itself to show the user, such as
+    the full-resolution image of a plot the model sees downscaled; the link is
+    kept as long as the artifact is.
+    """
+
+    def __init__(self, memory_budget=ARTIFACT_MEMORY_BUDGET, disk_budget=ARTIFACT_DISK_BUDGET):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.mime_types = {}
+        self.display_references = {}
+        self.lock = threading.Lock()
+
+    def put(self, data, mime_type, display_reference=None):
+        """
+        Store bytes and return their reference.
+
+        Args:
+            data (bytes): The artifact contents
+            mime_type (str): e.g. 'image/png'
+            display_reference (str): Reference of the version shown to the user instead, if any
+
+        Returns:
+            str: The artifact reference, 'artifact://<id>'
+        """
+        artifact_id = hashlib.sha256(data).hexdigest()[:32]
+        with self.lock:
+            if artifact_id in self.memory:
+                self.memory.move_to_end(artifact_id)
+            elif artifact_id not in self.disk:
+                self.memory[artifact_id] = data
+                self.memory_bytes += len(data)
+                self.mime_types[artifact_id] = mime_type
+            if display_reference is not None:
+                self.display_references[artifact_id] = display_reference
+            self._spill()
+        return f'{ARTIFACT_PREFIX}{artifact_id}'
+
+    def get(self, reference):
+        """
+        Return the bytes and mime type of a reference.
+
+        Returns:
+            tuple: (data, mime_type), or (None, None) if the artifact was evicted
+        """
+        artifact_id = reference[len(ARTIFACT_PREFIX):]
+        with self.lock:
+            if artifact_id in self.memory:
+                self.memory.move_to_end(artifact_id)
+                return self.memory[artifact_id], self.mime_types[artifact_id]
+            if artifact_id in self.disk:
+                self.disk.move_to_end(artifact_id)
+                with open(self._path(artifact_id), 'rb') as f:
+                    return f.read(), self.mime_types[artifact_id]
+        return None, None
+
+    def display_reference(self, reference):
+        """Return the reference of the version of an artifact shown to the user, the artifact itself if it has none."""
+        with self.lock:
+            return self.display_references.get(reference[len(ARTIFACT_PREFIX):], reference)
+
+    def data_url(self, reference):
+        """Return the base64 data URL of a reference, or None if the artifact was evicted."""
+        data, mime_type = self.get(reference)
+        if data is None:
+            return None
+        return f'data:{mime_type};base64,{base64.b64encode(data).decode("utf-8")}'
+
+    def _path(self, artifact_id):
+        return os.path.join(ARTIFACT_DIR, f'{artifact_id}.bin')
+
+    def _spill(self):
+        while self.memory_bytes > self.memory_budget and len(self.memory) > 1:
+            artifact_id, data = self.memory.popitem(last=False)
+            self.memory_bytes -= len(data)
+            try:
+                os.makedirs(ARTIFACT_DIR, exist_ok=True)
+                with open(self._path(artifact_id), 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                logging.error(f'Could not spill artifact {artifact_id} to disk: {str(e)}')
+                del self.mime_types[artifact_id]
+                self.display_references.pop(artifact_id, None)
+                continue
+            self.disk[artifact_id] = len(data)
+            self.disk_bytes += len(data)
+        while self.disk_bytes > self.disk_budget and self.disk:
+            artifact_id, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            del self.mime_types[artifact_id]
+            self.display_references.pop(artifact_id, None)
+            if os.path.exists(self._path(artifact_id)):
+                os.remove(self._path(artifact_id))
+
+
+artifact_store = ArtifactStore()
+
+
+def is_artifact(value):
+    return isinstance(value, str) and value.startswith(ARTIFACT_PREFIX)
+
+
+def materialize_artifacts(messages, keep_turns=ARTIFACT_KEEP_TURNS):
+    """
+    Build the message list sent to the API from one holding artifact references.
+
+    Images of the most recent keep_turns user turns are inlined as base64 data
+    URLs; older ones are replaced by a short note, as the model has already
+    described them. The stored messages are not modified.
+
+    Args:
+        messages (list): Responses API input items or chat completion messages
+        keep_turns (int): Number of recent user turns whose images are sent
+
+    Returns:
+        list: The messages to send
+    """
+    user_turns = [index for index, message in enumerate(messages) if message.get('role') == 'user']
+    if keep_turns == 0:
+        first_kept = len(messages)
+    elif len(user_turns) >= keep_turns:
+        first_kept = user_turns[-keep_turns]
+    else:
+        first_kept = 0
+
+    def resolve(reference, index):
+        data_url = artifact_store.data_url(reference) if index >= first_kept else None
+        if data_url is None:
+            logging.info(f'Omitting {reference} from the API request')
+        return data_url
+
+    materialized = []
+    for index, message in enumerate(messages):
+        if message.get('type') == 'function_call_output' and isinstance(message['output'], list):
+            output = []
+            for item in message['output']:
+                if item.get('type') == 'input_image' and is_artifact(item['image_url']):
+                    data_url = resolve(item['image_url'], index)
+                    item = {'type': 'input_image', 'image_url': data_url} if data_url else {'type': 'input_text', 'text': OMITTED_ARTIFACT_TEXT}
+                output.append(item)
+            message = {**message, 'output': output}
+        elif message.get('role') == 'tool' and is_artifact(message['content']):
+            data_url = resolve(message['content'], index)
+            message = {**message, 'content': data_url or OMITTED_ARTIFACT_TEXT}
+        materialized.append(message)
+    return materialized
@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# Memory budget shared by all sessions on this server for cached datasets
+DATASET_CACHE_BUDGET = 2 * 1024 * 1024 * 1024  # 2GB
+
+
+class DatasetCache:
+    """
+    Process-wide, content-addressed LRU cache of parsed datasets.
+
+    Entries are dicts holding at least the parsed 'dataframe', its 'profile' and
+    'fingerprint'. Every Streamlit session runs in the same process, so sessions
+    that load the same content share a single copy. Least recently used entries
+    are evicted once the memory budget is exceeded.
+    """
+
+    def __init__(self, budget_bytes=DATASET_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached entry for key, or None."""
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]['entry']
+
+    def put(self, key, entry, size_bytes):
+        """Cache entry under key, evicting least recently used entries to stay within budget."""
+        if size_bytes > self.budget_bytes:
+            logging.info(f'Dataset {key} ({size_bytes} bytes) exceeds the cache budget, not caching')
+            return
+        with self.lock:
+            if key in self.entries:
+                self.used_bytes -= self.entries.pop(key)['size_bytes']
+            self.entries[key] = {'entry': entry, 'size_bytes': size_bytes}
+            self.used_bytes += size_bytes
+            while self.used_bytes > self.budget_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.used_bytes -= evicted['size_bytes']
+                self._release(evicted_key, evicted['entry'])
+
+    def get_or_load(self, key, load_function):
+        """
+        Return the cached entry for key, loading and caching it on a miss.
+
+        Args:
+            key (str): The content key
+            load_function (callable): Returns (entry, size_bytes)
+        """
+        entry = self.get(key)
+        if entry is None:
+            entry, size_bytes = load_function()
+            self.put(key, entry, size_bytes)
+        return entry
+
+    def _release(self, key, entry):
+        logging.info(f'Evicting dataset {key} from the cache')
+        # Sessions that still hold a memory-mapped store keep their mapping after the file is removed
+        if 'dataframe_path' in entry and os.path.exists(entry['dataframe_path']):
+            os.remove(entry['dataframe_path'])
+
+
+dataset_cache = DatasetCache()
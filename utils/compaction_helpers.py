@@ -0,0 +1,127 @@
+import logging
+
+from utils.result_helpers import truncate_text
+from utils.token_helpers import within_limit
+
+# Context window usage above which older turns are compacted before the next turn
+COMPACTION_THRESHOLD = 0.5
+
+# Most recent user turns sent as they are, older turns are summarized
+COMPACTION_KEEP_TURNS = 2
+
+# Tool outputs of kept turns other than the latest are cut to this many tokens
+COMPACTION_STALE_OUTPUT_TOKENS = 500
+
+# Tool calls and outputs are cut to this many tokens in the transcript that is summarized
+COMPACTION_TRANSCRIPT_ITEM_TOKENS = 300
+
+# Model that writes the summary
+COMPACTION_MODEL = 'gpt-5-nano-2025-08-07'
+
+COMPACTION_INSTRUCTIONS = """You summarize the earlier part of a data analysis conversation between a user and an assistant that runs python tool calls on the user's datasets.
+The summary replaces those turns for the assistant, who continues the conversation from it.
+Keep the user's questions and requests, the findings with their numbers, the datasets, columns and global variables used, the plots that were made and what they showed, and anything still open.
+Leave out the code itself unless a later question depends on it. Be concise and use markdown bullet points.
+"""
+
+
+def is_user_turn(message):
+    return message.get('type') == 'message' and message.get('role') == 'user'
+
+
+def message_text(message):
+    return '\n'.join(part.get('text', '') for part in message['content'] if isinstance(part, dict))
+
+
+def format_transcript(messages):
+    """Render conversation items as a plain-text transcript for the summarizer, cutting long tool items."""
+    lines = []
+    for message in messages:
+        if message.get('type') == 'message' and message.get('role') in ['user', 'assistant']:
+            lines.append(f"{message['role'].capitalize()}: {message_text(message)}")
+        elif message.get('type') == 'function_call':
+            lines.append(f"Tool call {message['name']}: {truncate_text(message['arguments'], COMPACTION_TRANSCRIPT_ITEM_TOKENS)}")
+        elif message.get('type') == 'function_call_output':
+            if isinstance(message['output'], list):
+                lines.append('Tool output: a plot, shown to the user')
+            else:
+                lines.append(f"Tool output: {truncate_text(message['output'], COMPACTION_TRANSCRIPT_ITEM_TOKENS)}")
+    return '\n\n'.join(lines)
+
+
+def stub_stale_output(message):
+    """Cut the payload of an old tool output, keeping the item so its function call stays answered."""
+    if message.get('type') != 'function_call_output' or not isinstance(message['output'], str):
+        return message
+    if within_limit(message['output'], COMPACTION_STALE_OUTPUT_TOKENS):
+        return message
+    return {**message, 'output': truncate_text(message['output'], COMPACTION_STALE_OUTPUT_TOKENS)}
+
+
+def summary_message(summary):
+    return {
+        'role': 'developer',
+        'type': 'message',
+        'content': [
+            {
+                'type': 'input_text',
+                'text': f'Summary of the earlier conversation, its turns were compacted to save context:\n\n{summary}'
+            }
+        ]
+    }
+
+
+def compact_conversation(messages, compaction, summarize, keep_turns=COMPACTION_KEEP_TURNS):
+    """
+    Compact the conversation sent to the model.
+
+    Turns before the last keep_turns user turns are replaced by a summary,
+    and large tool outputs of the kept turns other than the latest are cut.
+    The cut is always at a user turn, so every function call sent keeps its
+    reasoning item and output. st.session_state['messages'] is not modified,
+    the UI still shows the whole conversation; the compacted items are kept
+    in the returned compaction and stay the same until the next compaction,
+    so the request prefix can still be served from the prompt cache.
+
+    Args:
+        messages (list): The conversation, starting with the system message
+        compaction (dict): The previous compaction, or None
+        summarize (callable): Called with (previous_summary, transcript), returns the new summary
+        keep_turns (int): Number of recent user turns kept
+
+    Returns:
+        dict: The compaction, {'summarized', 'summary', 'length', 'input'}, or the previous one if there is nothing to compact
+    """
+    user_turns = [index for index, message in enumerate(messages) if is_user_turn(message)]
+    if len(user_turns) <= keep_turns:
+        return compaction
+    boundary = user_turns[-keep_turns]
+    start = compaction['summarized'] if compaction else 1  # Skip the system message
+    if boundary <= start:
+        return compaction
+
+    summary = summarize(compaction['summary'] if compaction else None, format_transcript(messages[start:boundary]))
+    kept = [stub_stale_output(message) if index < user_turns[-1] else message for index, message in enumerate(messages[boundary:], start=boundary)]
+    logging.info(f'Compacted {boundary - start} conversation items into a summary, kept {len(kept)}')
+    return {
+        'summarized': boundary,
+        'summary': summary,
+        'length': len(messages),
+        'input': [summary_message(summary)] + kept,
+    }
+
+
+def build_input(messages, compaction):
+    """
+    Build the input items of a request from the conversation and its compaction.
+
+    Args:
+        messages (list): The conversation, starting with the system message
+        compaction (dict): The current compaction, or None
+
+    Returns:
+        list: The input items, without the system message which is sent as instructions
+    """
+    if compaction is None or len(messages) < compaction['length']:
+        return [message for message in messages if message.get('role') != 'system']
+    return compaction['input'] + messages[compaction['length']:]
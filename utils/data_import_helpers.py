@@ -7,6 +7,24 @@ import snowflake.connector
 # from sklearn.datasets import load_iris, load_diabetes, load_wine, load_breast_cancer
 from seaborn import load_dataset
 import logging
+import hashlib
+import time
+import pickle
+import pyarrow.feather as feather
+
+from utils.profile_helpers import profile_dataframe
+from utils.cache_helpers import dataset_cache
+
+# Limits of the primary key search
+PRIMARY_KEY_MAX_COLUMNS = 3
+PRIMARY_KEY_MAX_CANDIDATES = 200
+PRIMARY_KEY_TIME_BUDGET = 1.0  # seconds
+PRIMARY_KEY_SAMPLE_ROWS = 10_000
+PRIMARY_KEY_DISTINCT_TOLERANCE = 0.05
+PRIMARY_KEY_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# Prebuilt sample datasets, written by build_sample_datasets.py
+SAMPLE_DATASETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'sample_datasets')
 
 datasets = {
     'tips': {
@@ -88,6 +106,78 @@ datasets = {
     }
 }
 
+def fingerprint_dataframe(df):
+    """
+    Hash the contents, column names and data types of a DataFrame.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    hasher.update(str(list(df.columns)).encode())
+    hasher.update(str(df.dtypes.to_dict()).encode())
+    return hasher.hexdigest()
+
+def build_vetted_file(df, profile=None, fingerprint=None, primary_key=None):
+    """
+    Build the vetted file entry for a parsed and dtype-converted DataFrame.
+    """
+    if profile is None:
+        profile = profile_dataframe(df)
+    if fingerprint is None:
+        fingerprint = fingerprint_dataframe(df)
+    if primary_key is None:
+        primary_key = detect_primary_keys(df, profile)
+    vetted_file = {}
+    vetted_file['columns_names'] = df.columns
+    vetted_file['data_types'] = df.dtypes
+    vetted_file['profile'] = profile
+    vetted_file['pandas_describe'] = profile.describe()
+    vetted_file['fingerprint'] = fingerprint
+    vetted_file['primary_key'] = list(primary_key)
+    vetted_file['dataframe'] = df
+    return vetted_file
+
+def build_vetted_file_from_cache_entry(entry):
+    """
+    Build the vetted file entry for a dataset shared through the dataset cache.
+    """
+    if 'primary_key' not in entry:
+        entry['primary_key'] = detect_primary_keys(entry['dataframe'], entry['profile'])
+    # The cached frame is shared between sessions, so the session gets a shallow copy
+    return build_vetted_file(entry['dataframe'].copy(deep=False), entry['profile'], entry['fingerprint'], entry['primary_key'])
+
+def build_sample_dataset(filename):
+    """
+    Download, convert and profile a sample dataset and write it to SAMPLE_DATASETS_DIR.
+    """
+    df = load_dataset(filename)
+    df = df.convert_dtypes()
+    os.makedirs(SAMPLE_DATASETS_DIR, exist_ok=True)
+    # Uncompressed Feather files can be memory-mapped and keep the converted dtypes
+    feather.write_feather(df, os.path.join(SAMPLE_DATASETS_DIR, f'{filename}.feather'), compression='uncompressed')
+    with open(os.path.join(SAMPLE_DATASETS_DIR, f'{filename}.profile.pkl'), 'wb') as f:
+        pickle.dump({'profile': profile_dataframe(df), 'fingerprint': fingerprint_dataframe(df)}, f)
+
+def load_sample_dataset(filename):
+    """
+    Load a sample dataset and its profile for the dataset cache.
+
+    Uses the prebuilt files in SAMPLE_DATASETS_DIR when present, and falls back
+    to downloading the dataset through seaborn.
+    """
+    path = os.path.join(SAMPLE_DATASETS_DIR, f'{filename}.feather')
+    profile_path = os.path.join(SAMPLE_DATASETS_DIR, f'{filename}.profile.pkl')
+    if os.path.exists(path) and os.path.exists(profile_path):
+        df = feather.read_table(path, memory_map=True).to_pandas()
+        with open(profile_path, 'rb') as f:
+            entry = pickle.load(f)
+    else:
+        logging.warning(f'No prebuilt sample dataset for {filename}, downloading it with seaborn')
+        df = load_dataset(filename)
+        df = df.convert_dtypes()
+        entry = {'profile': profile_dataframe(df), 'fingerprint': fingerprint_dataframe(df)}
+    entry['dataframe'] = df
+    return entry, int(df.memory_usage(deep=True).sum())
+
 def gather_metadata(params=None):
     logging.info(f'gather_metadata - {st.session_state["session_id"]}')
     """
@@ -95,23 +185,15 @@ def gather_metadata(params=None):
     """
     vetted_files = {}
     if st.session_state['source'] == 'uploader':
-        for uploaded_file in st.session_state['uploaded_files']:
-            filename, _ = os.path.splitext(uploaded_file.name)
+        # Files were parsed and scanned once by ingest_csv, reuse those frames
+        for name, ingested_file in st.session_state['ingested_files'].items():
+            filename, _ = os.path.splitext(name)
             filename = filename.replace(' ', '_').replace('-', '_').lower().replace('(', '_').replace(')', '_')
-            vetted_files[filename] = {}
-            df = pd.read_csv(
-                filepath_or_buffer=uploaded_file, 
-                parse_dates=True,
-                low_memory=False,
-                encoding='utf-8',
-                encoding_errors='replace'
-            )
-            df = df.convert_dtypes()
-            vetted_files[filename]['columns_names'] = df.columns
-            vetted_files[filename]['data_types'] = df.dtypes
-            vetted_files[filename]['pandas_describe'] = df.describe(include='all')
-            vetted_files[filename]['primary_key'] = []
-            vetted_files[filename]['dataframe'] = df
+            vetted_files[filename] = build_vetted_file_from_cache_entry(ingested_file)
+            if 'dataframe_path' in ingested_file:
+                vetted_files[filename]['dataframe_path'] = ingested_file['dataframe_path']
+            vetted_files[filename]['security_scan'] = ingested_file['security_scan']
+            vetted_files[filename]['ingestion_stats'] = ingested_file['ingestion_stats']
     
     if st.session_state['source'] == 'snowflake':
         con = snowflake.connector.connect(
@@ -128,49 +210,90 @@ def gather_metadata(params=None):
         filename = 'snowflake_data'
         df = df.convert_dtypes()
         vetted_files = {}
-        vetted_files[filename] = {}
-        vetted_files[filename]['columns_names'] = df.columns
-        vetted_files[filename]['data_types'] = df.dtypes
-        vetted_files[filename]['pandas_describe'] = df.describe(include='all')
-        vetted_files[filename]['primary_key'] = []
-        vetted_files[filename]['dataframe'] = df
+        vetted_files[filename] = build_vetted_file(df)
     
     if st.session_state['source'] in ['tips', 'planets', 'penguins', 'car_crashes', 'diamonds', 'mpg']:
         filename = st.session_state['source']
-        df = load_dataset(filename)
-        df = df.convert_dtypes()
-        vetted_files[filename] = {}
+        # Sample datasets are loaded and profiled once per server and shared by every session
+        entry = dataset_cache.get_or_load(f'sample:{filename}', lambda: load_sample_dataset(filename))
+        vetted_files[filename] = build_vetted_file_from_cache_entry(entry)
         vetted_files[filename]['dataset_description'] = datasets[st.session_state['source']]['description']
-
-        vetted_files[filename]['columns_names'] = df.columns
-        vetted_files[filename]['data_types'] = df.dtypes
-        vetted_files[filename]['pandas_describe'] = df.describe(include='all')
-        vetted_files[filename]['primary_key'] = []
-        vetted_files[filename]['dataframe'] = df
     
     st.session_state['vetted_files'] = vetted_files
 
-# Function is too slow for larger datasets. Need to optimize. Not being used currently.
-def detect_primary_keys(df):
+def detect_primary_keys(df, profile=None):
     logging.info(f'detect_primary_keys - {st.session_state["session_id"]}')
     """
     Detect the primary key(s) of a pandas DataFrame.
+
+    Returns every single column that uniquely identifies the rows, or failing
+    that the first minimal combination of up to PRIMARY_KEY_MAX_COLUMNS columns.
+    Candidates are pruned with the per-column distinct counts of the profile,
+    rejected early on a sample of rows, and checked on the full frame with
+    combined 64-bit column hashes instead of comparing the values themselves.
     """
-    primary_keys = []
+    if profile is None:
+        profile = profile_dataframe(df)
+    rows = len(df)
+    if rows == 0:
+        return []
+
+    # Columns with missing values cannot be part of a primary key, constant columns add nothing.
+    # Float columns are measurements, whose values are unique by chance rather than identifiers
+    distinct = {}
     for column in df.columns:
-        if df[column].is_unique:
+        if pd.api.types.is_float_dtype(df[column].dtype):
+            continue
+        column_profile = profile.columns[column]
+        if column_profile.nulls == 0 and rows > 1 and column_profile.distinct.count() > 1:
+            distinct[column] = column_profile.distinct.count()
+    # Most selective columns first, they are the most likely to form a key
+    candidates = sorted(distinct, key=distinct.get, reverse=True)
+
+    sample = np.sort(np.random.default_rng(0).choice(rows, size=min(rows, PRIMARY_KEY_SAMPLE_ROWS), replace=False))
+    column_hashes = {}
+
+    def get_hash(column):
+        if column not in column_hashes:
+            column_hashes[column] = pd.util.hash_pandas_object(df[column], index=False).to_numpy()
+        return column_hashes[column]
+
+    def is_unique(columns):
+        combined = get_hash(columns[0])
+        for column in columns[1:]:
+            # Mix the hashes so that (a, b) and (b, a) do not collide
+            combined = combined * np.uint64(PRIMARY_KEY_HASH_MULTIPLIER) ^ get_hash(column)
+        # A duplicate within the sample is a duplicate in the full frame
+        if pd.Series(combined[sample]).duplicated().any():
+            return False
+        # Equal rows always hash equal, so unique hashes prove unique rows
+        return not pd.Series(combined).duplicated().any()
+
+    start_time = time.perf_counter()
+    primary_keys = []
+    for column in candidates:
+        # HyperLogLog estimates are within a few percent of the true distinct count
+        if distinct[column] >= rows * (1 - PRIMARY_KEY_DISTINCT_TOLERANCE) and is_unique([column]):
             primary_keys.append(column)
-    
+
     if not primary_keys:
-        n_cols = len(df.columns)
-        for r in range(2, n_cols+1):
-            for columns in itertools.combinations(df.columns, r):
-                if df[list(columns)].duplicated().sum() == 0:
+        checked = 0
+        for r in range(2, min(len(candidates), PRIMARY_KEY_MAX_COLUMNS) + 1):
+            for columns in itertools.combinations(candidates, r):
+                if time.perf_counter() - start_time > PRIMARY_KEY_TIME_BUDGET or checked >= PRIMARY_KEY_MAX_CANDIDATES:
+                    logging.info(f'detect_primary_keys - search budget exhausted after {checked} candidates - {st.session_state["session_id"]}')
+                    return []
+                # The columns cannot be unique together if they do not have enough distinct combinations
+                if np.prod([float(distinct[column]) for column in columns]) < rows * (1 - PRIMARY_KEY_DISTINCT_TOLERANCE):
+                    continue
+                checked += 1
+                if is_unique(list(columns)):
                     primary_keys.extend(columns)
                     break
             if primary_keys:
                 break
 
+    logging.info(f'detect_primary_keys - {primary_keys} in {time.perf_counter() - start_time:.3f}s - {st.session_state["session_id"]}')
     return primary_keys
 
 def convert_data_dictionary_to_json(vetted_files):
@@ -212,12 +335,25 @@ def check_datatypes(vetted_files):
                 vetted_files[filename]['dataframe'][column] = vetted_files[filename]['dataframe'][column].astype('category')
     return vetted_files
 
+def refresh_profiles(vetted_files):
+    logging.info(f'refresh_profiles - {st.session_state["session_id"]}')
+    """
+    Re-profile datasets whose data types were changed in the data dictionary.
+    """
+    for filename in vetted_files:
+        if not vetted_files[filename]['dataframe'].dtypes.equals(vetted_files[filename]['profile'].dtypes):
+            vetted_files[filename]['profile'] = profile_dataframe(vetted_files[filename]['dataframe'])
+            vetted_files[filename]['pandas_describe'] = vetted_files[filename]['profile'].describe()
+            vetted_files[filename]['fingerprint'] = fingerprint_dataframe(vetted_files[filename]['dataframe'])
+    return vetted_files
+
 def process_data_dictionaries(vetted_files, page):
     logging.info(f'process_data_dictionaries - {st.session_state["session_id"]}')
     """
     Process data dictionaries.
     """
     vetted_files=check_datatypes(vetted_files)
+    vetted_files=refresh_profiles(vetted_files)
     vetted_files=convert_data_dictionary_to_json(vetted_files)
     # st.session_state['active_page'] = page
     st.session_state['vetted_files'] = vetted_files
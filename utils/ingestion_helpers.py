@@ -0,0 +1,432 @@
+import streamlit as st
+import logging
+import re
+import os
+import hashlib
+import time
+import uuid
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils.profile_helpers import DatasetProfile, profile_dataframe, SAMPLE_ROWS
+from utils.cache_helpers import dataset_cache
+
+# Uploads above this size are streamed to an on-disk store instead of being loaded eagerly
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Uploads above this size are rejected
+STREAMING_MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
+
+# Number of rows parsed, scanned and written at a time in streaming mode
+CHUNK_SIZE = 100_000
+
+# Directory holding the Arrow IPC stores written in streaming mode
+STORE_DIR = os.path.join(tempfile.gettempdir(), 'arctic_analytics')
+
+# Define suspicious patterns (e.g., script tags, executable commands)
+suspicious_patterns = [
+    r'<script.*?>',
+    r'\bexec\s*\(["\']',  # exec function call with string argument
+    r'\beval\s*\(["\']',  # eval function call with string argument
+    r'\bsystem\s*\(["\']',  # system function call with string argument
+    r'^=cmd\|',  # Excel formula with cmd
+    r'^=.*\|\|',  # Excel formula with pipes
+    r'^=.*DDE\s*\(',  # Only match formulas that start with = and have DDE function call
+    r'^=[+@-]'  # Common Excel formula injection markers at start
+]
+pattern_regex = re.compile('|'.join(suspicious_patterns), re.IGNORECASE)
+
+# CSV parser: 'pyarrow' parses multithreaded straight into nullable columns,
+# 'c' is the original pandas parser followed by convert_dtypes
+CSV_ENGINE = 'pyarrow'
+
+# Dtype backend of the parsed frame: 'numpy_nullable' or 'pyarrow'
+DTYPE_BACKEND = 'numpy_nullable'
+
+# Text columns whose first value looks like this are tried as ISO 8601 dates and timestamps
+ISO_DATE_REGEX = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# String dtype of both ingestion paths with the 'numpy_nullable' backend. Arrow-backed
+# strings wrap the buffers of a streamed store without copying them
+STRING_DTYPE = pd.StringDtype('pyarrow')
+
+# Pandas dtypes of the Arrow types in a streamed store with the 'numpy_nullable' backend,
+# the dtypes convert_column_types gives in-memory uploads
+NULLABLE_DTYPES = {
+    pa.null(): pd.Int64Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.float64(): pd.Float64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.string(): STRING_DTYPE,
+    pa.large_string(): STRING_DTYPE,
+}
+
+# Options for the 'c' engine, which is also the fallback when pyarrow cannot parse a file
+read_csv_options = {
+    'parse_dates': True,
+    'low_memory': False,
+    'encoding': 'utf-8',
+    'encoding_errors': 'replace',
+}
+
+def scan_file_header(file):
+    """
+    Check the first kilobyte of a file for suspicious content.
+
+    Args:
+        file: The uploaded file object
+
+    Returns:
+        tuple: (is_valid, error_message)
+    """
+    pos = file.tell()
+    content_sample = file.read(1024).decode('utf-8', 'ignore')
+    file.seek(pos)
+
+    for pattern in suspicious_patterns:
+        if re.search(pattern, content_sample, re.IGNORECASE):
+            return False, "Suspicious content detected in file header"
+    return True, ""
+
+def read_csv_file(file, engine=CSV_ENGINE, dtype_backend=DTYPE_BACKEND):
+    """
+    Parse a CSV file into a DataFrame with nullable dtypes.
+
+    Args:
+        file: The uploaded file object
+        engine (str): 'pyarrow' or 'c'
+        dtype_backend (str): 'numpy_nullable' or 'pyarrow'
+
+    Returns:
+        tuple: (dataframe, engine_used)
+    """
+    if engine == 'pyarrow':
+        pos = file.tell()
+        try:
+            df = pd.read_csv(
+                filepath_or_buffer=file,
+                engine='pyarrow',
+                dtype_backend=dtype_backend,
+                encoding='utf-8',
+            )
+            # pyarrow reads columns with invalid utf-8 as raw bytes, which would
+            # slip past the security scan, so those files go through the c engine
+            undecoded_columns = [
+                column for column, dtype in df.dtypes.items()
+                if str(dtype).startswith('binary') or (dtype == 'object' and pd.api.types.infer_dtype(df[column], skipna=True) == 'bytes')
+            ]
+            if not undecoded_columns:
+                return convert_column_types(df, dtype_backend), 'pyarrow'
+            logging.warning('pyarrow CSV engine returned undecoded columns, falling back to c engine')
+        except Exception as e:
+            logging.warning(f'pyarrow CSV engine failed, falling back to c engine: {str(e)}')
+        file.seek(pos)
+
+    df = pd.read_csv(filepath_or_buffer=file, **read_csv_options)
+    df = convert_column_types(df, dtype_backend)
+    return df, 'c'
+
+def convert_column_types(df, dtype_backend=DTYPE_BACKEND):
+    """
+    Convert parsed columns to the types every ingestion path gives them.
+
+    Columns become nullable numbers, booleans and strings, strings stored as
+    STRING_DTYPE with the 'numpy_nullable' backend. Dates and timestamps
+    become datetime64[ns] whether pyarrow inferred them or they are ISO 8601
+    text from the c engine, so a file gets the same dtypes from either engine
+    and from every chunk of a streamed upload.
+
+    Args:
+        df (pd.DataFrame): The parsed DataFrame
+        dtype_backend (str): 'numpy_nullable' or 'pyarrow'
+
+    Returns:
+        pd.DataFrame: The converted DataFrame
+    """
+    df = df.convert_dtypes(dtype_backend=dtype_backend)
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+            if dtype != 'datetime64[ns]':
+                df[column] = df[column].astype('datetime64[ns]')
+        elif dtype == 'object':
+            # pyarrow returns date-only columns as datetime.date objects
+            if pd.api.types.infer_dtype(df[column], skipna=True) == 'date':
+                df[column] = pd.to_datetime(df[column])
+        elif pd.api.types.is_string_dtype(dtype):
+            first_value = df[column].first_valid_index()
+            if first_value is not None and ISO_DATE_REGEX.match(df[column][first_value]):
+                try:
+                    df[column] = pd.to_datetime(df[column], format='ISO8601').astype('datetime64[ns]')
+                    continue
+                except (ValueError, TypeError, OverflowError):
+                    pass
+            # convert_dtypes gives Python-backed strings, streamed stores Arrow-backed ones
+            if dtype_backend == 'numpy_nullable' and dtype != STRING_DTYPE:
+                df[column] = df[column].astype(STRING_DTYPE)
+    return df
+
+def scan_dataframe(df):
+    """
+    Check every string cell of a DataFrame for suspicious patterns.
+
+    Args:
+        df (pd.DataFrame): The parsed DataFrame
+
+    Returns:
+        tuple: (is_valid, error_message)
+    """
+    for column in df.columns:
+        if df[column].dtype != 'object' and not pd.api.types.is_string_dtype(df[column].dtype):
+            continue  # Skip numeric columns
+
+        # Repeated values only need to be scanned once, in order of first appearance
+        values = pd.Series(df[column].dropna().astype(str).unique(), dtype=object)
+
+        # Every suspicious pattern needs a leading '=' or contains '<' or '(',
+        # so a vectorized prefilter discards the vast majority of cells
+        candidates = values[
+            values.str.startswith('=')
+            | values.str.contains('<', regex=False)
+            | values.str.contains('(', regex=False)
+        ]
+
+        # Run the full regex only on the remaining candidates
+        for value in candidates:
+            match = pattern_regex.search(value)
+            if match:
+                matched_pattern = match.group(0)
+                return False, f"Suspicious content detected in cell: '{value[:50]}{'...' if len(value) > 50 else ''}' (matched pattern: '{matched_pattern}')"
+    return True, ""
+
+def store_dtype(arrow_type):
+    """Return the pandas dtype of an Arrow store column, the one DTYPE_BACKEND gives in-memory uploads."""
+    if DTYPE_BACKEND == 'pyarrow':
+        return pd.ArrowDtype(arrow_type)
+    return NULLABLE_DTYPES.get(arrow_type)
+
+def store_to_pandas(table):
+    """Convert a table of an Arrow store to a DataFrame with the dtypes of in-memory uploads."""
+    return table.to_pandas(types_mapper=store_dtype)
+
+def load_arrow_store(path):
+    """
+    Load an Arrow IPC store as a memory-mapped DataFrame.
+
+    String columns wrap the mapped buffers without copying, so the operating system
+    pages the text in on demand instead of it living in session state.
+    """
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    return store_to_pandas(table)
+
+def widen_type(current_type, new_type):
+    """Return the narrowest Arrow type that holds the values of both types."""
+    if current_type == new_type or pa.types.is_null(new_type):
+        return current_type
+    if pa.types.is_null(current_type):
+        return new_type
+    if pa.types.is_integer(current_type) and pa.types.is_integer(new_type):
+        return pa.int64()
+    if all(pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) for arrow_type in (current_type, new_type)):
+        return pa.float64()
+    return pa.string()
+
+def chunk_to_table(chunk):
+    """Convert a chunk to an Arrow table, typing its all-null columns as null so any later type can replace them."""
+    table = pa.Table.from_pandas(chunk, preserve_index=False).replace_schema_metadata()
+    columns = [pa.nulls(len(column)) if column.null_count == len(column) else column for column in table.columns]
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+def rewrite_store(path, writer, schema, columns):
+    """
+    Copy the rows written to a store so far into a new store with a wider schema.
+
+    Args:
+        path (str): The path of the store
+        writer: The open writer of the store, it is closed
+        schema (pa.Schema): The widened schema
+        columns (list): The columns whose type changed, to profile again
+
+    Returns:
+        tuple: (writer, profile) - the writer of the new store, for the following chunks,
+            and the profile of the changed columns over the copied rows
+    """
+    writer.close()
+    profile = DatasetProfile()
+    temporary_path = f'{path}.tmp'
+    new_writer = pa.ipc.new_file(temporary_path, schema)
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            table = pa.Table.from_batches([reader.get_batch(index)]).cast(schema)
+            new_writer.write_table(table)
+            profile.update(store_to_pandas(table.select(columns)))
+    # The new writer keeps appending to the renamed file
+    os.replace(temporary_path, path)
+    return new_writer, profile
+
+def ingest_csv_streaming(file, content_hash):
+    """
+    Validate and parse a large CSV file chunk by chunk into an on-disk Arrow IPC store.
+
+    Each chunk is scanned for malicious content, folded into the dataset
+    profile and appended to the store. Column types are inferred per chunk
+    like for in-memory uploads and widened as chunks arrive (null to any type,
+    integer to float, anything else to string); when a column widens, the rows
+    written so far are rewritten with the new type and the column re-profiled.
+
+    Args:
+        file: The uploaded file object
+        content_hash (str): The sha256 of the file contents
+
+    Returns:
+        tuple: (is_valid, error_message, ingested_file)
+    """
+    logging.info(f'ingest_csv_streaming - {st.session_state["session_id"]}')
+    os.makedirs(STORE_DIR, exist_ok=True)
+    path = os.path.join(STORE_DIR, f'{st.session_state["session_id"]}_{uuid.uuid4().hex}.arrow')
+
+    start_time = time.perf_counter()
+    writer = None
+    schema = None
+    profile = DatasetProfile()
+    rows = 0
+    error_message = ""
+    try:
+        with pd.read_csv(filepath_or_buffer=file, chunksize=CHUNK_SIZE, **read_csv_options) as reader:
+            for chunk in reader:
+                is_valid, error_message = scan_dataframe(chunk)
+                if not is_valid:
+                    break
+
+                chunk = convert_column_types(chunk)
+                table = chunk_to_table(chunk)
+                if schema is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(path, schema)
+                else:
+                    widened_schema = pa.schema([
+                        pa.field(field.name, widen_type(field.type, new_type))
+                        for field, new_type in zip(schema, table.schema.types)
+                    ])
+                    widened_columns = [field.name for field, widened_field in zip(schema, widened_schema) if field.type != widened_field.type]
+                    if widened_columns:
+                        logging.info(f'Widening columns {widened_columns} of {file.name} after row {rows} - {st.session_state["session_id"]}')
+                        writer, widened_profile = rewrite_store(path, writer, widened_schema, widened_columns)
+                        profile.replace_columns(widened_profile)
+                        schema = widened_schema
+                    if table.schema != schema:
+                        # All-null columns need no conversion, they profile the same with any type
+                        converted = any(not pa.types.is_null(new_type) and new_type != field.type for field, new_type in zip(schema, table.schema.types))
+                        table = table.cast(schema)
+                        if converted:
+                            chunk = store_to_pandas(table)
+
+                profile.update(chunk)
+                writer.write_table(table)
+                rows += len(chunk)
+    except Exception as e:
+        error_message = f"Invalid CSV format: {str(e)}"
+    finally:
+        if writer is not None:
+            writer.close()
+        file.seek(0)  # Reset file pointer
+
+    if not error_message and writer is None:
+        error_message = "The CSV file has no rows"
+    if error_message:
+        # Do not leave partially written stores of rejected files behind
+        if os.path.exists(path):
+            os.remove(path)
+        return False, error_message, None
+
+    parse_seconds = time.perf_counter() - start_time
+    memory_bytes = os.path.getsize(path)
+    logging.info(f'Streamed {file.name} ({rows} rows) to {path} in {parse_seconds:.3f}s, {memory_bytes / 1024 / 1024:.1f}MB on disk - {st.session_state["session_id"]}')
+
+    df = load_arrow_store(path)
+    # Earlier chunks were profiled before their columns widened
+    profile.dtypes = df.dtypes
+    profile.head = df.head(SAMPLE_ROWS)
+    ingested_file = {
+        'dataframe': df,
+        'dataframe_path': path,
+        'data_types': df.dtypes,
+        'profile': profile,
+        'fingerprint': content_hash,
+        'security_scan': {'is_valid': True, 'error_message': ""},
+        'ingestion_stats': {'engine': 'streaming', 'parse_seconds': parse_seconds, 'memory_bytes': memory_bytes},
+    }
+    dataset_cache.put(content_hash, ingested_file, memory_bytes)
+    return True, "", ingested_file
+
+def ingest_csv(file):
+    """
+    Validate and parse an uploaded CSV file in a single pass.
+
+    The file is parsed once; the resulting DataFrame is scanned for malicious
+    content and handed on to gather_metadata so it never has to be re-read.
+    Files above MAX_FILE_SIZE are handed to ingest_csv_streaming. Accepted
+    files are cached process-wide by content hash, so re-uploads of the same
+    file in any session skip parsing and profiling entirely.
+
+    Args:
+        file: The uploaded file object
+
+    Returns:
+        tuple: (is_valid, error_message, ingested_file)
+            ingested_file is a dict with the dataframe, its data types, profile,
+            fingerprint and the security scan result, or None if the file was
+            rejected. It is shared between sessions and must not be mutated.
+    """
+    logging.info(f'ingest_csv - {st.session_state["session_id"]}')
+    # Check file size (500MB limit)
+    if file.size > STREAMING_MAX_FILE_SIZE:
+        return False, "File size exceeds 500MB limit", None
+
+    try:
+        # First do a quick check of the beginning of the file
+        is_valid, error_message = scan_file_header(file)
+        if not is_valid:
+            return False, error_message, None
+
+        content_hash = hashlib.sha256(file.getvalue()).hexdigest()
+        ingested_file = dataset_cache.get(content_hash)
+        if ingested_file is not None:
+            logging.info(f'Dataset cache hit for {file.name} - {st.session_state["session_id"]}')
+            return True, "", ingested_file
+
+        # Files above 10MB are streamed to disk instead of being loaded eagerly
+        if file.size > MAX_FILE_SIZE:
+            return ingest_csv_streaming(file, content_hash)
+
+        # Now check if file can be parsed as CSV
+        try:
+            start_time = time.perf_counter()
+            df, engine = read_csv_file(file)
+            parse_seconds = time.perf_counter() - start_time
+            file.seek(0)  # Reset file pointer
+        except Exception as e:
+            return False, f"Invalid CSV format: {str(e)}", None
+
+        memory_bytes = int(df.memory_usage(deep=True).sum())
+        logging.info(f'Parsed {file.name} with {engine} engine in {parse_seconds:.3f}s, {memory_bytes / 1024 / 1024:.1f}MB in memory - {st.session_state["session_id"]}')
+
+        is_valid, error_message = scan_dataframe(df)
+        if not is_valid:
+            return False, error_message, None
+
+        ingested_file = {
+            'dataframe': df,
+            'data_types': df.dtypes,
+            'profile': profile_dataframe(df),
+            'fingerprint': content_hash,
+            'security_scan': {'is_valid': is_valid, 'error_message': error_message},
+            'ingestion_stats': {'engine': engine, 'parse_seconds': parse_seconds, 'memory_bytes': memory_bytes},
+        }
+        dataset_cache.put(content_hash, ingested_file, memory_bytes)
+        return True, "", ingested_file
+    except Exception as e:
+        return False, f"Error validating CSV: {str(e)}", None
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+import importlib.util
+import httpx
+from openai import AsyncOpenAI
+
+# Connections to the API shared by all sessions
+LLM_MAX_CONNECTIONS = 100
+
+# Idle connections kept open so the next request skips the TCP and TLS handshake
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20
+
+# Seconds an idle connection is kept open
+LLM_KEEPALIVE_EXPIRY = 120
+
+# Seconds to wait for a connection and for a response, long reasoning responses need the latter
+LLM_CONNECT_TIMEOUT = 10
+LLM_READ_TIMEOUT = 600
+
+# HTTP/2 multiplexes concurrent requests over one connection, it needs the optional h2 package
+LLM_HTTP2 = importlib.util.find_spec('h2') is not None
+
+event_loop = None
+event_loop_lock = threading.Lock()
+async_openai_client = None
+
+
+def get_event_loop():
+    """
+    Return the event loop shared by all sessions, starting it on first use.
+
+    The loop runs on a daemon thread and owns the async clients; Streamlit
+    session threads hand it coroutines with run_async instead of each making
+    their own blocking connections.
+    """
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, name='llm_event_loop', daemon=True).start()
+            if not LLM_HTTP2:
+                logging.warning('h2 is not installed, API requests use HTTP/1.1 keep-alive connections')
+    return event_loop
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def run_async(awaitable):
+    """Run an awaitable on the shared event loop and wait for its result in the calling thread."""
+    return asyncio.run_coroutine_threadsafe(_await(awaitable), get_event_loop()).result()
+
+
+def get_async_openai_client():
+    """Return the AsyncOpenAI client shared by all sessions, with a pooled HTTP transport."""
+    global async_openai_client
+    loop = get_event_loop()
+    with event_loop_lock:
+        if async_openai_client is None:
+            http_client = httpx.AsyncClient(
+                http2=LLM_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+            async_openai_client = AsyncOpenAI(http_client=http_client)
+            logging.info(f'Created the shared AsyncOpenAI client on {loop}')
+    return async_openai_client
+
+
+class StreamBridge:
+    """
+    Drives an async stream manager of the OpenAI SDK from a session thread.
+
+    The stream runs on the shared event loop; the session thread iterates its
+    events synchronously, so it can render each one with Streamlit as it
+    arrives. Used like the sync SDK stream:
+
+        with StreamBridge(client.responses.stream(**kwargs)) as stream:
+            for event in stream:
+                ...
+            response = stream.get_final_response()
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.stream = None
+
+    def __enter__(self):
+        self.stream = run_async(self.manager.__aenter__())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        run_async(self.manager.__aexit__(exc_type, exc, tb))
+        return False
+
+    def __iter__(self):
+        events = self.stream.__aiter__()
+        while True:
+            try:
+                yield run_async(events.__anext__())
+            except StopAsyncIteration:
+                return
+
+    def get_final_response(self):
+        return run_async(self.stream.get_final_response())
@@ -1,36 +1,25 @@
 import streamlit as st
 import replicate
-import tiktoken
 import json
 import logging
-import requests
 import os
 
 from utils.system_messages import construct_system_message
 from utils.streamlit_helpers import reset_data_analyst
-
-enc_gpt4 = tiktoken.encoding_for_model("gpt-4")
+from utils.token_helpers import token_counter, count_tokens
 
 temperature = 0.1
 top_p = 0.1
 
 
 def token_count_message(message):
-    str = ''
-    for msg in message:
-        if 'content'in msg:
-            str = f"{str}role: {msg['role']}, message: {msg['content']}\n"
-        elif 'tool_calls' in msg:
-            for tool_call in msg['tool_calls']:
-                str = f"{str}role: {msg['role']}, tool_call: {tool_call['function']['name']}, arguments: {tool_call['function']['arguments']}\n"
-    return len(enc_gpt4.encode(str))
+    # Only messages added since the last turn are encoded
+    return token_counter.conversation_tokens(message)
 
 
 class MetaLlama:
     def __init__(self):
-        self.session = requests.Session()
         os.environ['REPLICATE_API_TOKEN'] = st.secrets['REPLICATE_API_TOKEN']
-        enc_gpt4 = tiktoken.encoding_for_model("gpt-4")
 
 
     # def construct_llama_prompt(self, vetted_files):
@@ -97,4 +86,4 @@ class MetaLlama:
         return ''.join(events)
 
     def token_count_message(self, prompt_str):
-        return len(enc_gpt4.encode(prompt_str))
+        return count_tokens(prompt_str)
@@ -1,11 +1,9 @@
 import streamlit as st
-from openai import OpenAI
 from tenacity import (
     retry,
     stop_after_attempt,
     wait_random_exponential,
 )
-import tiktoken
 import logging
 import json
 import re
@@ -14,8 +12,6 @@ import traceback  # Add traceback module import
 from pydantic import BaseModel, Field
 import pandas as pd
 import plotly.graph_objects as go
-import io
-import base64
 import matplotlib.pyplot as plt
 import matplotlib.figure as mfigure
 import openai
@@ -23,6 +19,12 @@ import openai
 from utils.system_messages import construct_system_message
 from utils.streamlit_helpers import safely_escape_dollars, render_tool_call, render_tool_response
 from utils.security_helpers import safely_execute_code
+from utils.tool_dispatch_helpers import dispatch_tool_calls
+from utils.plot_helpers import encode_figure
+from utils.result_helpers import encode_result, truncate_text, RESULT_TOKEN_LIMIT
+from utils.token_helpers import estimate_tokens, within_limit, token_counter
+from utils.llm_client_helpers import get_async_openai_client, run_async
+from utils.artifact_helpers import materialize_artifacts
 
 
 class ResponseFormat(BaseModel):
@@ -32,18 +34,12 @@ class ResponseFormat(BaseModel):
 
 class OpenAIChatCompletionsUtility:
     def __init__(self):
-        self.client = OpenAI()
-        self.enc_gpt4 = tiktoken.encoding_for_model("gpt-4")
+        # Shared by all sessions, requests run on the shared event loop over pooled connections
+        self.client = get_async_openai_client()
 
     def token_count_message(self, message):
-        str = ''
-        for msg in message:
-            if 'content'in msg:
-                str = f"{str}role: {msg['role']}, message: {msg['content']}\n"
-            elif 'tool_calls' in msg:
-                for tool_call in msg['tool_calls']:
-                    str = f"{str}role: {msg['role']}, tool_call: {tool_call['function']['name']}, arguments: {tool_call['function']['arguments']}\n"
-        return len(self.enc_gpt4.encode(str))
+        # Only messages added since the last turn are encoded
+        return token_counter.conversation_tokens(message)
 
     def _calculate_cost(self, prompt_tokens, completion_tokens=0, model=''):
         """
@@ -83,8 +79,10 @@ class OpenAIChatCompletionsUtility:
     # @retry(wait=wait_random_exponential(min=5, max=10), stop=stop_after_attempt(5))
     def _completion_with_backoff(self, **kwargs):
         logging.info(f'completion_with_backoff - {st.session_state["session_id"]}')
+        # Messages refer to plots by artifact id, base64 is only built for the request
+        kwargs['messages'] = materialize_artifacts(kwargs['messages'])
         try:
-            return self.client.beta.chat.completions.parse(**kwargs)
+            return run_async(self.client.beta.chat.completions.parse(**kwargs))
         except openai.BadRequestError as e:
             # Detect the specific "context_length_exceeded" error
             err_code = getattr(e, "code", None)
@@ -129,53 +127,68 @@ class OpenAIChatCompletionsUtility:
             args.pop('temperature', None)            
         return args
         
-    def _handle_tool_calls(self, tool_calls, tool_handlers, messages):
-        """Processes tool calls and updates messages with tool responses"""
-        for tool_call in tool_calls:
-            logging.info(f'Calling tool: {tool_call.function.name}')
+    def _run_tool_call(self, tool_call, tool_handlers):
+        """Runs a single tool call and returns its tool message and whether it failed"""
+        logging.info(f'Calling tool: {tool_call.function.name}')
+        
+        try:
+            tool_name = tool_call.function.name
+            args_dict = json.loads(tool_call.function.arguments)
             
-            try:
-                tool_name = tool_call.function.name
-                args_dict = json.loads(tool_call.function.arguments)
-                
-                if tool_name in tool_handlers:
-                    tool_response = tool_handlers[tool_name](args_dict)
-                else:
-                    tool_response = f"Tool '{tool_name}' not implemented or not available."
-                
-                messages.append({
-                    'role': 'tool', 
-                    'content': str(tool_response), 
-                    'tool_call_id': tool_call.id
-                })
-                with st.session_state['messages_container']:
-                    render_tool_response(str(tool_response))
+            if tool_name in tool_handlers:
+                tool_response = tool_handlers[tool_name](args_dict)
+            else:
+                tool_response = f"Tool '{tool_name}' not implemented or not available."
+            
+            return {
+                'role': 'tool', 
+                'content': str(tool_response), 
+                'tool_call_id': tool_call.id
+            }, False
+
+        except Exception as e:
+            # Log the full traceback for debugging purposes
+            full_traceback = traceback.format_exc()
+            logging.error(f"Error executing tool {tool_call.function.name}: {full_traceback}")
+            
+            # Provide a clean error message with exception type and message
+            # but without potentially sensitive path information
+            error_type = type(e).__name__
+            error_message = f"Error executing tool {tool_call.function.name}: {error_type}: {str(e)}"
+            
+            # Extract line information from the traceback for better debugging help
+            tb_lines = full_traceback.splitlines()
+            for line in tb_lines:
+                if "line" in line and ", in " in line:
+                    # This captures the line number information without file paths
+                    error_message += "\n" + line.split(", in ")[-1]
+                    
+            return {
+                'role': 'tool', 
+                'content': error_message, 
+                'tool_call_id': tool_call.id
+            }, True
+
+    def _render_tool_output(self, tool_call, output):
+        """Renders a tool response as soon as its tool call finishes"""
+        message, failed = output
+        with st.session_state['messages_container']:
+            if failed:
+                with st.expander(f"🛠️ See Tool Response"):
+                    st.write(safely_escape_dollars(message['content']))
+            else:
+                render_tool_response(message['content'])
 
-            except Exception as e:
-                # Log the full traceback for debugging purposes
-                full_traceback = traceback.format_exc()
-                logging.error(f"Error executing tool {tool_call.function.name}: {full_traceback}")
-                
-                # Provide a clean error message with exception type and message
-                # but without potentially sensitive path information
-                error_type = type(e).__name__
-                error_message = f"Error executing tool {tool_call.function.name}: {error_type}: {str(e)}"
-                
-                # Extract line information from the traceback for better debugging help
-                tb_lines = full_traceback.splitlines()
-                for line in tb_lines:
-                    if "line" in line and ", in " in line:
-                        # This captures the line number information without file paths
-                        error_message += "\n" + line.split(", in ")[-1]
-                        
-                messages.append({
-                    'role': 'tool', 
-                    'content': error_message, 
-                    'tool_call_id': tool_call.id
-                })
-                with st.session_state['messages_container']:
-                    with st.expander(f"🛠️ See Tool Response"):
-                        st.write(safely_escape_dollars(str(error_message)))
+    def _handle_tool_calls(self, tool_calls, tool_handlers, messages):
+        """Processes tool calls and updates messages with tool responses"""
+        # Independent tool calls of one response run in parallel, messages keep the call order
+        outputs = dispatch_tool_calls(
+            tool_calls,
+            lambda tool_call: self._run_tool_call(tool_call, tool_handlers),
+            self._render_tool_output
+        )
+        for message, _ in outputs:
+            messages.append(message)
         
         return messages
 
@@ -362,17 +375,17 @@ class OpenAIChatCompletionsUtility:
             # parse result to check if it is a DataFrame or Plotly figure
             if isinstance(result, pd.DataFrame):
                 logging.info('Result is a DataFrame')
-                # Only do one conversion to JSON, not two
-                result = result.to_json(orient='index')
+                # Serialize in the format that costs the fewest tokens
+                result = encode_result(result)
 
             elif isinstance(result, pd.Series):
                 logging.info('Result is a pandas Series')
-                result = result.to_json(orient='index')
+                result = encode_result(result)
 
             elif isinstance(result, dict):
                 logging.info('Result is a dict')
                 # Convert dict to DataFrame
-                result = pd.DataFrame.from_dict(result, orient='index').to_json(orient='index')
+                result = encode_result(pd.DataFrame.from_dict(result, orient='index'))
 
             elif isinstance(result, (int, float)) or (hasattr(result, 'dtype') and np.issubdtype(result.dtype, np.number)):
                 # Handle both Python and NumPy numeric types
@@ -380,12 +393,12 @@ class OpenAIChatCompletionsUtility:
                 # Convert NumPy types to native Python types if needed
                 if hasattr(result, 'item'):
                     result = result.item()
-                result = pd.DataFrame({'result': [result]}).to_json(orient='index')
+                result = encode_result(pd.DataFrame({'result': [result]}))
 
             elif isinstance(result, list):
                 logging.info(f'Result is a list: {result}')
                 # Convert list to DataFrame
-                result = pd.DataFrame(result).to_json(orient='index')
+                result = encode_result(pd.DataFrame(result))
 
             elif isinstance(result, mfigure.Figure):
                 logging.info('Result is a Matplotlib Figure, but it was created using the wrong tool')
@@ -405,14 +418,9 @@ class OpenAIChatCompletionsUtility:
         elif report_function == 'generate_plot':
             if isinstance(result, mfigure.Figure):
                 logging.info('Result is a Matplotlib Figure')
-                # convert to URL
-                buf = io.BytesIO()
-                result.savefig(buf, format='png')
+                # Draw once, downscale and compress for the model, keep the full resolution for the UI
+                img_url = encode_figure(result)
                 plt.close(result)
-                buf.seek(0)
-                img_bytes = buf.getvalue()
-                img_b64 = base64.b64encode(img_bytes).decode('utf-8')
-                img_url = f'data:image/png;base64,{img_b64}'
                 result = img_url
             else:
                 logging.info(f'Result is not a matplotlib.figure.Figure: {type(result)}')
@@ -421,13 +429,13 @@ class OpenAIChatCompletionsUtility:
         logging.info(f'Final execution result - {result[:100]}... - {st.session_state["session_id"]}' 
                     if len(str(result)) > 100 else f'Final execution result - {result} - {st.session_state["session_id"]}')
 
-        # calculate token count for the result
-        token_count = len(self.enc_gpt4.encode(str(result)))
-        logging.info(f'Token count for tool response - {token_count} - {st.session_state["session_id"]}')
+        # check the result against the token budget
+        logging.info(f'Estimated token count for tool response - {estimate_tokens(str(result))} - {st.session_state["session_id"]}')
 
-        if token_count >= 5000 and report_function != 'generate_plot':
-            logging.error(f"Code execution returned a result of {token_count} tokens. Please refactor the code to keep the result under 5000 tokens.")
-            result = f"Code execution returned a result of {token_count} tokens. Please refactor the code to keep the result under 5000 tokens."
+        if report_function != 'generate_plot' and not within_limit(result, RESULT_TOKEN_LIMIT):
+            # Tables are already shaped to the budget, this cuts down any other long result
+            logging.warning(f"Code execution returned a result of more than {RESULT_TOKEN_LIMIT} tokens, truncating it")
+            result = truncate_text(result, RESULT_TOKEN_LIMIT)
 
         return result
 
@@ -1,6 +1,6 @@
 import streamlit as st
 import base64
-from openai import OpenAI, pydantic_function_tool
+from openai import pydantic_function_tool
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -12,61 +12,75 @@ from typing import Dict, Any, List, Optional, Type
 from pydantic import BaseModel
 import os
 import uuid
+import time
+import hashlib
+import openai
 import matplotlib.pyplot as plt
 import matplotlib.figure as mfigure
 import pandas as pd
 import numpy as np
 import io
-import tiktoken
 
 # from utils.system_messages import construct_system_message
 from utils.streamlit_helpers import safely_escape_dollars, render_tool_call, render_tool_response
-from utils.security_helpers import safely_execute_code
+from utils.security_helpers import safely_execute_code, get_session_variables, pop_lost_session_variables
+from utils.tool_dispatch_helpers import dispatch_tool_calls
+from utils.plot_helpers import encode_figure
+from utils.result_helpers import encode_result, truncate_text, RESULT_TOKEN_LIMIT, SESSION_VARIABLES_HEADER
+from utils.token_helpers import estimate_tokens, within_limit
+from utils.llm_client_helpers import get_async_openai_client, run_async, StreamBridge
+from utils.response_cache_helpers import response_cache
+from utils.system_messages import get_system_message_key
+from utils.compaction_helpers import compact_conversation, build_input, COMPACTION_THRESHOLD, COMPACTION_MODEL, COMPACTION_INSTRUCTIONS
+from utils.artifact_helpers import is_artifact, materialize_artifacts
 
 
 
 class OpenAIResponsesUtility:
     def __init__(self):
-        self.client = OpenAI()
-        self.enc_gpt4 = tiktoken.encoding_for_model("gpt-4")
+        # Shared by all sessions, requests run on the shared event loop over pooled connections
+        self.client = get_async_openai_client()
 
     @retry(wait=wait_random_exponential(min=5, max=10), stop=stop_after_attempt(5))
     def _embedding_with_backoff(self, **kwargs):
         logging.info(f'embedding_with_backoff - {st.session_state["session_id"]}')
-        return self.client.embeddings.create(**kwargs)
+        return run_async(self.client.embeddings.create(**kwargs))
 
-    def _calculate_cost(self, prompt_tokens, completion_tokens=0, model=''):
+    def _calculate_cost(self, prompt_tokens, completion_tokens=0, model='', cached_tokens=0):
         """
         Calculate API cost based on token usage and model
         Args:
-            prompt_tokens: Number of prompt tokens
+            prompt_tokens: Number of prompt tokens, including the cached ones
             completion_tokens: Number of completion tokens (default 0 for embeddings)
             model: Model name used for the API call
+            cached_tokens: Number of prompt tokens served from the prompt cache, billed at the cached input rate
         Returns:
             cost_USD: Cost in USD
         """
+        uncached_tokens = prompt_tokens - cached_tokens
         # Standard rates for common models (these can be updated as pricing changes)
         if model == 'text-embedding-3-small':
             # Embedding models
             return prompt_tokens * 0.02/1000000
         elif model == 'gpt-4.1-nano-2025-04-14':
-            return 0.1*prompt_tokens/1000000 + 0.4*completion_tokens/1000000
+            return 0.1*uncached_tokens/1000000 + 0.025*cached_tokens/1000000 + 0.4*completion_tokens/1000000
         elif model == 'gpt-4.1-mini-2025-04-14':
-            return 0.4*prompt_tokens/1000000 + 1.6*completion_tokens/1000000
+            return 0.4*uncached_tokens/1000000 + 0.1*cached_tokens/1000000 + 1.6*completion_tokens/1000000
         elif model == 'o4-mini-2025-04-16':
-            return 1.1*prompt_tokens/1000000 + 4.4*completion_tokens/1000000
+            return 1.1*uncached_tokens/1000000 + 0.275*cached_tokens/1000000 + 4.4*completion_tokens/1000000
         elif model == 'gpt-4.1-2025-04-14':
-            return 2*prompt_tokens/1000000 + 8*completion_tokens/1000000
+            return 2*uncached_tokens/1000000 + 0.5*cached_tokens/1000000 + 8*completion_tokens/1000000
         elif model == 'o3-2025-04-16':
-            return 2*prompt_tokens/1000000 + 8*completion_tokens/1000000
+            return 2*uncached_tokens/1000000 + 0.5*cached_tokens/1000000 + 8*completion_tokens/1000000
         elif model == 'o3-pro-2025-06-10':
+            # No cached input rate
             return 20*prompt_tokens/1000000 + 80*completion_tokens/1000000
         elif model == 'gpt-5-2025-08-07':
-            return 1.25*prompt_tokens/1000000 + 10*completion_tokens/1000000
+            return 1.25*uncached_tokens/1000000 + 0.125*cached_tokens/1000000 + 10*completion_tokens/1000000
         elif model == 'gpt-5-mini-2025-08-07':
-            return 0.25*prompt_tokens/1000000 + 2*completion_tokens/1000000
+            return 0.25*uncached_tokens/1000000 + 0.025*cached_tokens/1000000 + 2*completion_tokens/1000000
         elif model == 'gpt-5-nano-2025-08-07':
-            return 0.05*prompt_tokens/1000000 + 0.4*completion_tokens/1000000
+            return 0.05*uncached_tokens/1000000 + 0.005*cached_tokens/1000000 + 0.4*completion_tokens/1000000
         else:
             st.error(f"Model {model} not recognized for cost calculation.")
 
@@ -87,13 +101,72 @@ class OpenAIResponsesUtility:
         tokens = response.usage.total_tokens
         model = response.model
         cost_USD = self._calculate_cost(tokens, model=model)
+        # Embeddings are made on the session's behalf, e.g. for the response cache, so they count towards its cost
+        st.session_state['cost'] += cost_USD
+        logging.info(f'Embedding cost - {cost_USD} USD - {st.session_state["session_id"]}')
 
         return embeddings   
 
     # @retry(wait=wait_random_exponential(min=5, max=10), stop=stop_after_attempt(5))
     def _responses_with_backoff(self, **kwargs):
         logging.info(f'responses_with_backoff - {st.session_state["session_id"]}')
-        return self.client.responses.parse(**kwargs)
+        # Messages refer to plots by artifact id, base64 is only built for the request
+        kwargs['input'] = materialize_artifacts(kwargs['input'])
+        return self._stream_response(**kwargs)
+
+    def _stream_deltas(self, events, delta_type, done_type):
+        """Yields the text deltas of one output part until it is done, for st.write_stream"""
+        for event in events:
+            if event.type == delta_type:
+                yield safely_escape_dollars(event.delta)  # Safely escape dollar signs for LaTeX rendering
+            elif event.type == done_type:
+                return
+
+    def _stream_response(self, **kwargs):
+        """
+        Streams a response into the UI as the model generates it.
+
+        Reasoning summaries and the answer are written with st.write_stream,
+        the arguments of function calls are shown while they are written and
+        replaced by the tool call once complete.
+
+        Returns:
+            The final parsed response, as returned by responses.parse
+        """
+        start_time = time.perf_counter()
+        first_event_time = None
+        with StreamBridge(self.client.responses.stream(**kwargs)) as stream:
+            events = iter(stream)
+            for event in events:
+                if first_event_time is None and event.type != 'response.created' and event.type != 'response.in_progress':
+                    first_event_time = time.perf_counter()
+                    logging.info(f'Time to first output: {first_event_time - start_time:.2f}s - {st.session_state["session_id"]}')
+
+                if event.type == 'response.reasoning_summary_part.added':
+                    with st.session_state['messages_container']:
+                        with st.expander(f"🧠 Agent Reasoning", expanded=True):
+                            st.write_stream(self._stream_deltas(events, 'response.reasoning_summary_text.delta', 'response.reasoning_summary_text.done'))
+
+                elif event.type == 'response.output_item.added' and event.item.type == 'message':
+                    with st.session_state['messages_container']:
+                        st.chat_message('assistant').write_stream(self._stream_deltas(events, 'response.output_text.delta', 'response.output_item.done'))
+
+                elif event.type == 'response.output_item.added' and event.item.type == 'function_call':
+                    with st.session_state['messages_container']:
+                        placeholder = st.empty()
+                    arguments = ''
+                    for event in events:
+                        if event.type == 'response.function_call_arguments.delta':
+                            arguments += event.delta
+                            placeholder.code(arguments, language='json')
+                        elif event.type == 'response.output_item.done':
+                            break
+                    with placeholder.container():
+                        render_tool_call({'name': event.item.name, 'arguments': event.item.arguments})
+
+            response = stream.get_final_response()
+        logging.info(f'Response streamed in {time.perf_counter() - start_time:.2f}s - {st.session_state["session_id"]}')
+        return response
 
     def _extract_tools_and_handlers(self, tool_config):
         """Extracts tool specifications and handlers from the tool configuration"""
@@ -111,13 +184,22 @@ class OpenAIResponsesUtility:
                     
         return tools, tool_handlers
 
+    def _prompt_cache_key(self, model, instructions, tools):
+        """Key of the static request prefix, so turns and sessions on the same datasets hit the same prompt cache"""
+        prefix = json.dumps([model, instructions, tools], sort_keys=True)
+        return f'arctic-analytics-{hashlib.sha256(prefix.encode()).hexdigest()[:32]}'
+
     def _prepare_api_args(self, messages, model, temperature, response_format, reasoning_effort, tools, tool_choice, include):
+        instructions = messages[0]['content'][0]['text']
         args = {
-            'input': messages,
-            'instructions': messages[0]['content'][0]['text'],
+            # The system message is only sent as instructions. Tools, instructions and the
+            # earlier turns then form a prefix that stays byte-identical from turn to turn.
+            'input': build_input(messages, st.session_state.get('compaction')),
+            'instructions': instructions,
             'model': model,
             'temperature': temperature,
-            'include': include
+            'include': include,
+            'prompt_cache_key': self._prompt_cache_key(model, instructions, tools),
         }
 
         if tools:
@@ -144,14 +226,18 @@ class OpenAIResponsesUtility:
     def _process_api_response(self, response, messages, session_id, model, image_params):
         outputs = response.output
         prompt_tokens = response.usage.input_tokens
+        cached_tokens = response.usage.input_tokens_details.cached_tokens
         completion_tokens = response.usage.output_tokens
         total_tokens = prompt_tokens + completion_tokens
         logging.info(f'Prompt tokens: {prompt_tokens}')
+        logging.info(f'Cached prompt tokens: {cached_tokens} ({cached_tokens / max(prompt_tokens, 1):.0%})')
         logging.info(f'Completion tokens: {completion_tokens}')
+        st.session_state['input_tokens'] = st.session_state.get('input_tokens', 0) + prompt_tokens
+        st.session_state['cached_tokens'] = st.session_state.get('cached_tokens', 0) + cached_tokens
 
         
         # Calculate cost using the new method
-        cost_USD = self._calculate_cost(prompt_tokens, completion_tokens, model)
+        cost_USD = self._calculate_cost(prompt_tokens, completion_tokens, model, cached_tokens)
         context_window_usage = self._calculate_context_window_usage(total_tokens, model)
         # st.toast(f"Cost for this API call: ${cost_USD:.6f}")
         
@@ -164,13 +250,8 @@ class OpenAIResponsesUtility:
             # elif output.type == 'web_search_call':
             #     messages.append(output.to_dict())
             elif output.type == 'reasoning':
+                # The summary was already shown while the response streamed
                 messages.append(output.to_dict())
-                summary_list = output.to_dict()['summary']
-                if summary_list != []:
-                    for summary in summary_list:
-                        with st.session_state['messages_container']:
-                            with st.expander(f"🧠 Agent Reasoning", expanded=True):
-                                st.write(safely_escape_dollars(summary['text']))  # Safely escape dollar signs for LaTeX rendering
             # elif output.type in ['mcp_list_tools', 'mcp_call']:
             #     messages.append(output.to_dict())
             elif output.type == 'function_call':
@@ -185,14 +266,6 @@ class OpenAIResponsesUtility:
                     'name': function_name,
                     'arguments': arguments
                 })
-                with st.session_state['messages_container']:
-                    render_tool_call({
-                        'type': 'function_call',
-                        'id': id,
-                        'call_id': call_id,
-                        'name': function_name,
-                        'arguments': arguments
-                    })
 
                 output_dict = output.to_dict()
                 if 'parsed_arguments' in output_dict:
@@ -228,59 +301,116 @@ class OpenAIResponsesUtility:
 
         return tool_calls, cost_USD, messages, images, context_window_usage
 
-    def _process_tool_call_loop(self, tool_calls, messages, tool_handlers, args, session_id, model):
+    def _run_tool_call(self, tool_call, tool_handlers):
+        """Runs a single tool call and returns its function_call_output message and the response to render"""
+        logging.info(f'Calling tool: {tool_call['name']}')
+        logging.info(f'Tool call arguments: {tool_call['arguments']}')
+
+        try:
+            tool_name = tool_call['name']
+            args_dict = json.loads(tool_call['arguments'])
+            
+            if tool_name in tool_handlers:
+                tool_response = tool_handlers[tool_name](args_dict)
+            else:
+                tool_response = f"Tool '{tool_name}' not implemented or not available."
+
+            if is_artifact(tool_response):
+                message = {
+                    'type': 'function_call_output',
+                    'call_id': tool_call['call_id'],
+                    'output': [
+                        {
+                            'type': 'input_image',
+                            'image_url': tool_response
+                        }
+                    ],
+                }
+            else:                           
+                message = {
+                    'type': 'function_call_output',
+                    'call_id': tool_call['call_id'],
+                    'output': str(tool_response),
+                }
+            return message, tool_response
+        except Exception as e:
+            error_message = f"Error executing tool {tool_call['name']}: {str(e)}"
+            logging.error(error_message)
+            message = {
+                'type': 'function_call_output',
+                'call_id': tool_call['call_id'],
+                'output': error_message
+            }
+            return message, error_message
+
+    def _render_tool_output(self, tool_call, output):
+        """Renders a tool response as soon as its tool call finishes"""
+        _, tool_response = output
+        with st.session_state['messages_container']:
+            render_tool_response(tool_response)
+
+    def _compact_conversation(self, messages):
+        """Compacts the conversation sent to the model and returns the cost of the summary"""
+        logging.info(f'compact_conversation - {st.session_state["session_id"]}')
+        costs = []
+
+        def summarize(previous_summary, transcript):
+            text = f'Summary so far:\n\n{previous_summary}\n\n' if previous_summary else ''
+            text += f'Turns to add to the summary:\n\n{transcript}'
+            response = run_async(self.client.responses.create(
+                model=COMPACTION_MODEL,
+                instructions=COMPACTION_INSTRUCTIONS,
+                input=text,
+                reasoning={'effort': 'minimal'},
+            ))
+            costs.append(self._calculate_cost(response.usage.input_tokens, response.usage.output_tokens, COMPACTION_MODEL))
+            return response.output_text
+
+        try:
+            with st.spinner('Summarizing earlier turns...'):
+                st.session_state['compaction'] = compact_conversation(messages, st.session_state.get('compaction'), summarize)
+        except openai.OpenAIError as e:
+            # The turn goes ahead with the previous compaction
+            logging.error(f'Could not compact the conversation: {str(e)}')
+        return sum(costs)
+
+    def _is_missing_previous_response(self, error):
+        """Checks whether an API error says the response a request was chained to is not stored"""
+        if not isinstance(error, (openai.NotFoundError, openai.BadRequestError)):
+            return False
+        if getattr(error, 'code', None) == 'previous_response_not_found':
+            return True
+        message = str(getattr(error, 'message', error)).lower()
+        return 'previous response' in message and 'not found' in message
+
+    def _process_tool_call_loop(self, tool_calls, messages, tool_handlers, args, session_id, model, response_id):
         """Handles the recursive tool call processing"""
         tool_cost = 0
         
         while tool_calls != []:
-            for tool_call in tool_calls:
-                    logging.info(f'Calling tool: {tool_call['name']}')
-                    logging.info(f'Tool call arguments: {tool_call['arguments']}')
-
-                    try:
-                        tool_name = tool_call['name']
-                        args_dict = json.loads(tool_call['arguments'])
-                        
-                        if tool_name in tool_handlers:
-                            tool_response = tool_handlers[tool_name](args_dict)
-                        else:
-                            tool_response = f"Tool '{tool_name}' not implemented or not available."
-
-                        if tool_response.startswith('data:image/png;base64,'): 
-                            messages.append({
-                                'type': 'function_call_output',
-                                'call_id': tool_call['call_id'],
-                                'output': [
-                                    {
-                                        'type': 'input_image',
-                                        'image_url': tool_response
-                                    }
-                                ],
-                            })
-                        else:                           
-                            messages.append({
-                                'type': 'function_call_output',
-                                'call_id': tool_call['call_id'],
-                                'output': str(tool_response),
-                            })
-                        with st.session_state['messages_container']:
-                            render_tool_response(tool_response)
-                    except Exception as e:
-                        error_message = f"Error executing tool {tool_call['name']}: {str(e)}"
-                        logging.error(error_message)
-                        messages.append({
-                            'type': 'function_call_output',
-                            'call_id': tool_call['call_id'],
-                            'output': error_message
-                        })
-                        with st.session_state['messages_container']:
-                            render_tool_response(error_message)
-        
+            # Independent tool calls of one response run in parallel, outputs keep the call order
+            outputs = dispatch_tool_calls(
+                tool_calls,
+                lambda tool_call: self._run_tool_call(tool_call, tool_handlers),
+                self._render_tool_output
+            )
+            for message, _ in outputs:
+                messages.append(message)
 
-            # Update messages in args and set tool_choice to auto for follow-up call
-            args['input'] = messages
+            # Chain the follow-up call to the previous response, so only the tool outputs are uploaded
             args['tool_choice'] = 'auto'
-            response = self._responses_with_backoff(**args)
+            chained_args = {**args, 'input': [message for message, _ in outputs], 'previous_response_id': response_id}
+            try:
+                response = self._responses_with_backoff(**chained_args)
+            except (openai.NotFoundError, openai.BadRequestError) as e:
+                # Only a missing previous response is worth resending for, other errors would fail and bill twice
+                if not self._is_missing_previous_response(e):
+                    raise
+                # The previous response is not stored (e.g. expired), send the whole conversation
+                logging.warning(f'Could not chain to response {response_id}, resending the conversation: {str(e)}')
+                args['input'] = build_input(messages, st.session_state.get('compaction'))
+                response = self._responses_with_backoff(**args)
+            response_id = response.id
 
             # Process the follow-up response
             tool_calls, cost_USD_inner, messages, images, context_window_usage = self._process_api_response(
@@ -334,6 +464,11 @@ class OpenAIResponsesUtility:
         # else:
         #     image_params = None
 
+        # Summarize older turns once the context fills up, so each turn costs about the same
+        cost_USD_compaction = 0
+        if st.session_state.get('context_window_usage', 0) > COMPACTION_THRESHOLD:
+            cost_USD_compaction = self._compact_conversation(messages)
+
         # # Extract tool specs and handlers
         tools, tool_handlers = self._extract_tools_and_handlers(tool_config)
 
@@ -359,11 +494,11 @@ class OpenAIResponsesUtility:
         images_2 = None
         if tool_calls is not None and tool_calls != []:
             messages, images_2, cost_USD_tool, context_window_usage_2 = self._process_tool_call_loop(
-                tool_calls, messages, tool_handlers, args, session_id, model
+                tool_calls, messages, tool_handlers, args, session_id, model, response.id
             )
             
         # Calculate total cost at the end
-        cost_USD = cost_USD_initial + cost_USD_tool
+        cost_USD = cost_USD_initial + cost_USD_tool + cost_USD_compaction
         # Context window usage is cumulative - use the latest value from tool loop if present, otherwise initial
         context_window_usage = context_window_usage_2 if context_window_usage_2 != 0 else context_window_usage_1
         if images_1:
@@ -423,30 +558,31 @@ class OpenAIResponsesUtility:
 
         # Execute the code with a timeout - pass None for report_function 
         # to let execute_with_timeout decide how to handle the result
-        result, stdout_output, error_message = safely_execute_code(python_code, vetted_files, report_function)
+        # Run in the session's persistent namespace so later calls can reuse global variables
+        result, stdout_output, error_message = safely_execute_code(python_code, vetted_files, report_function, session_id=st.session_state['session_id'])
 
         logging.info(f'Stdout output - {stdout_output} - {st.session_state["session_id"]}')
 
         if error_message:
             logging.error(f'Error executing code: {error_message}')
             result = f"Error executing code: {error_message}\n\nStdout Output: {stdout_output}"
-            return result
+            return result + self._format_session_variables()
 
         if report_function == 'generate_report' or report_function is None:
             # parse result to check if it is a DataFrame or Plotly figure
             if isinstance(result, pd.DataFrame):
                 logging.info('Result is a DataFrame')
-                # Only do one conversion to JSON, not two
-                result = result.to_json(orient='index')
+                # Serialize in the format that costs the fewest tokens
+                result = encode_result(result)
 
             elif isinstance(result, pd.Series):
                 logging.info('Result is a pandas Series')
-                result = result.to_json(orient='index')
+                result = encode_result(result)
 
             elif isinstance(result, dict):
                 logging.info('Result is a dict')
                 # Convert dict to DataFrame
-                result = pd.DataFrame.from_dict(result, orient='index').to_json(orient='index')
+                result = encode_result(pd.DataFrame.from_dict(result, orient='index'))
 
             elif isinstance(result, (int, float)) or (hasattr(result, 'dtype') and np.issubdtype(result.dtype, np.number)):
                 # Handle both Python and NumPy numeric types
@@ -454,12 +590,12 @@ class OpenAIResponsesUtility:
                 # Convert NumPy types to native Python types if needed
                 if hasattr(result, 'item'):
                     result = result.item()
-                result = pd.DataFrame({'result': [result]}).to_json(orient='index')
+                result = encode_result(pd.DataFrame({'result': [result]}))
 
             elif isinstance(result, list):
                 logging.info(f'Result is a list: {result}')
                 # Convert list to DataFrame
-                result = pd.DataFrame(result).to_json(orient='index')
+                result = encode_result(pd.DataFrame(result))
 
             elif isinstance(result, mfigure.Figure):
                 logging.info('Result is a Matplotlib Figure, but it was created using the wrong tool')
@@ -479,14 +615,9 @@ class OpenAIResponsesUtility:
         elif report_function == 'generate_plot':
             if isinstance(result, mfigure.Figure):
                 logging.info('Result is a Matplotlib Figure')
-                # convert to URL
-                buf = io.BytesIO()
-                result.savefig(buf, format='png')
+                # Draw once, downscale and compress for the model, keep the full resolution for the UI
+                img_url = encode_figure(result)
                 plt.close(result)
-                buf.seek(0)
-                img_bytes = buf.getvalue()
-                img_b64 = base64.b64encode(img_bytes).decode('utf-8')
-                img_url = f'data:image/png;base64,{img_b64}'
                 result = img_url
             else:
                 logging.info(f'Result is not a matplotlib.figure.Figure: {type(result)}')
@@ -495,16 +626,28 @@ class OpenAIResponsesUtility:
         logging.info(f'Final execution result - {result[:100]}... - {st.session_state["session_id"]}' 
                     if len(str(result)) > 100 else f'Final execution result - {result} - {st.session_state["session_id"]}')
 
-        # calculate token count for the result
-        token_count = len(self.enc_gpt4.encode(str(result)))
-        logging.info(f'Token count for tool response - {token_count} - {st.session_state["session_id"]}')
+        # check the result against the token budget
+        logging.info(f'Estimated token count for tool response - {estimate_tokens(str(result))} - {st.session_state["session_id"]}')
+
+        if report_function != 'generate_plot' and not within_limit(result, RESULT_TOKEN_LIMIT):
+            # Tables are already shaped to the budget, this cuts down any other long result
+            logging.warning(f"Code execution returned a result of more than {RESULT_TOKEN_LIMIT} tokens, truncating it")
+            result = truncate_text(result, RESULT_TOKEN_LIMIT)
 
-        if token_count >= 5000 and report_function != 'generate_plot':
-            logging.error(f"Code execution returned a result of {token_count} tokens. Please refactor the code to keep the result under 5000 tokens.")
-            result = f"Code execution returned a result of {token_count} tokens. Please refactor the code to keep the result under 5000 tokens."
+        if report_function != 'generate_plot':
+            result += self._format_session_variables()
 
         return result
 
+    def _format_session_variables(self):
+        """Lists the variables kept from earlier tool calls so the model can reuse them, and those that were dropped"""
+        lost_variables = pop_lost_session_variables(st.session_state['session_id'])
+        lost = f"\n\nThe variables {', '.join(lost_variables)} kept from earlier tool calls were dropped from the sandbox and no longer exist. Recompute them before using them again." if lost_variables else ""
+        variables = get_session_variables(st.session_state['session_id'])
+        if not variables:
+            return lost
+        return lost + SESSION_VARIABLES_HEADER + "\n".join(variables)
+
     def generate_openai_response(self, vetted_files, model):
         logging.info(f'generate_openai_response - {st.session_state["session_id"]}')
 
@@ -533,7 +676,7 @@ class OpenAIResponsesUtility:
         run_python_function_toolspec = {
             "type": "function",
             "name": "run_python_function",
-            "description": "Run a python function called generate_report. The function must intake 0 arguments and return a single pandas DataFrame or a pandas Series or a python dictionary. You can only use the pandas, numpy, datetime and math libraries.",
+            "description": "Run a python function called generate_report. The function must intake 0 arguments and return a single pandas DataFrame or a pandas Series or a python dictionary. You can only use the pandas, numpy, datetime and math libraries. To reuse an expensive intermediate result (a merge, groupby or pivot) in later tool calls, declare it with the global statement inside the function and assign it; it stays available by name to later run_python_expression, run_python_function and generate_plot calls.",
             "strict": True,
             "parameters": {
                 "type": "object",
@@ -604,9 +747,28 @@ class OpenAIResponsesUtility:
                 )
             }
         ]
-        response, _, cost, context_window_usage = self.responses_APIcall(st.session_state['messages'], model=model, temperature=0.1, tool_config=tool_config)
+        # The first question of a conversation is answered from the response cache when another
+        # session already asked it of the same datasets, e.g. with the sample buttons
+        messages = st.session_state['messages']
+        user_turns = [message for message in messages if message.get('type') == 'message' and message.get('role') == 'user']
+        if len(user_turns) == 1:
+            question = user_turns[0]['content'][0]['text']
+            scope = f'{model}|{get_system_message_key(vetted_files, agent_model=True)}'
+            embed = lambda text: self.create_embedding_APICall(text, page='analytics_agent')
+            cached_messages, cached_context_window_usage, embedding = response_cache.lookup(scope, question, embed)
+            if cached_messages is not None:
+                messages.extend(cached_messages)
+                st.session_state['context_window_usage'] = cached_context_window_usage
+                return messages
+            question_index = len(messages)
+
+        response, _, cost, context_window_usage = self.responses_APIcall(messages, model=model, temperature=0.1, tool_config=tool_config)
 
         st.session_state['prompt_str'] = ""
         st.session_state['cost'] += cost
         st.session_state['context_window_usage'] = context_window_usage
+
+        # Only complete answers are cached
+        if len(user_turns) == 1 and response[-1].get('type') == 'message' and response[-1].get('role') == 'assistant':
+            response_cache.put(scope, question, response[question_index:], context_window_usage, embedding, embed)
         return response
\ No newline at end of file
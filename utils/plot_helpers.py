@@ -0,0 +1,131 @@
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from utils.artifact_helpers import artifact_store
+
+# Resolution the figure is drawn at, the UI shows this raster
+PLOT_DPI = 150
+
+# Longest side of the image sent to the model; 512 pixels fit a single image tile
+PLOT_MODEL_MAX_PIXELS = 512
+
+# Longest side of the image shown in the UI
+PLOT_UI_MAX_PIXELS = 1600
+
+# Format of the model-facing image: 'png', 'webp' or 'jpeg'
+PLOT_FORMAT = 'png'
+
+# Palette size of quantized PNGs, plots rarely use more colors; 0 keeps full RGB
+PLOT_PNG_COLORS = 256
+
+# Quality of lossy WebP/JPEG images
+PLOT_LOSSY_QUALITY = 85
+
+# Number of encoded figures kept
+PLOT_CACHE_SIZE = 64
+
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+plot_cache = OrderedDict()
+plot_cache_lock = threading.Lock()
+
+
+def render_figure(figure, dpi=PLOT_DPI):
+    """Draw a figure once on an Agg canvas and return the raster as an RGB image."""
+    canvas = figure.canvas if isinstance(figure.canvas, FigureCanvasAgg) else FigureCanvasAgg(figure)
+    original_dpi = figure.dpi
+    figure.dpi = dpi
+    try:
+        canvas.draw()
+        image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return image.convert('RGB')
+    finally:
+        figure.dpi = original_dpi
+
+
+def downscale(image, max_pixels):
+    """Shrink an image so its longest side is at most max_pixels."""
+    if max(image.size) <= max_pixels:
+        return image
+    image = image.copy()
+    image.thumbnail((max_pixels, max_pixels), Image.Resampling.LANCZOS)
+    return image
+
+
+def encode_image(image, image_format, optimize=True):
+    """
+    Encode an image compactly.
+
+    Args:
+        image (PIL.Image.Image): The RGB image
+        image_format (str): 'png', 'webp' or 'jpeg'
+        optimize (bool): Spend extra time on a smaller PNG
+
+    Returns:
+        bytes: The encoded image
+    """
+    buf = io.BytesIO()
+    if image_format == 'png':
+        if PLOT_PNG_COLORS:
+            image = image.quantize(colors=PLOT_PNG_COLORS, method=Image.Quantize.FASTOCTREE)
+        image.save(buf, format='PNG', optimize=optimize)
+    elif image_format == 'webp':
+        image.save(buf, format='WEBP', quality=PLOT_LOSSY_QUALITY, method=4)
+    else:
+        image.save(buf, format='JPEG', quality=PLOT_LOSSY_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def encode_figure(figure):
+    """
+    Encode a matplotlib figure for the model and the UI.
+
+    The figure is drawn once; the model gets a downscaled, compactly encoded
+    copy and the UI keeps the full-resolution raster. Encodings are cached by
+    the hash of the drawn pixels, so re-running a plot skips downscaling and
+    encoding. (Pickled figures cannot be used as the key, they hold object ids.)
+    The UI image is linked to the model image in the artifact store, so it is
+    found for as long as the model image is, see get_ui_image.
+
+    Args:
+        figure (matplotlib.figure.Figure): The figure to encode
+
+    Returns:
+        str: The artifact reference of the model-facing image
+    """
+    image = render_figure(figure)
+    key = (PLOT_FORMAT, hashlib.sha256(image.tobytes()).hexdigest())
+    with plot_cache_lock:
+        if key in plot_cache:
+            plot_cache.move_to_end(key)
+            return plot_cache[key]
+
+    model_bytes = encode_image(downscale(image, PLOT_MODEL_MAX_PIXELS), PLOT_FORMAT)
+    # The UI image stays on the server, so it is not worth optimizing
+    ui_bytes = encode_image(downscale(image, PLOT_UI_MAX_PIXELS), 'png', optimize=False)
+    logging.info(f'Encoded figure {image.size} - model {len(model_bytes)} bytes, UI {len(ui_bytes)} bytes')
+
+    ui_reference = artifact_store.put(ui_bytes, MIME_TYPES['png'])
+    model_reference = artifact_store.put(model_bytes, MIME_TYPES[PLOT_FORMAT], display_reference=ui_reference)
+    with plot_cache_lock:
+        plot_cache[key] = model_reference
+        if len(plot_cache) > PLOT_CACHE_SIZE:
+            plot_cache.popitem(last=False)
+    return model_reference
+
+
+def get_ui_image(model_reference):
+    """Return the image bytes to show for a plot, full resolution if still stored, or None if evicted."""
+    ui_reference = artifact_store.display_reference(model_reference)
+    if ui_reference != model_reference:
+        data, _ = artifact_store.get(ui_reference)
+        if data is not None:
+            return data
+    data, _ = artifact_store.get(model_reference)
+    return data
@@ -0,0 +1,337 @@
+import numpy as np
+import pandas as pd
+
+# Compression parameter of the t-digest, higher keeps more centroids and gives more accurate quantiles
+TDIGEST_COMPRESSION = 100
+
+# Number of HyperLogLog register bits, 2**12 registers give ~1.6% standard error
+HLL_PRECISION = 12
+
+# Number of frequent values tracked per column
+TOP_K = 20
+
+# Number of rows kept for the first/last rows of the dataset
+SAMPLE_ROWS = 5
+
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+class Welford:
+    """Running count, mean, variance, min and max, mergeable across chunks (Chan et al.)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Fold an array of non-null numbers into the running statistics, min and max keep the array's type."""
+        if len(values) == 0:
+            return
+        other = Welford()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = values.min()
+        other.max = values.max()
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+
+
+class TDigest:
+    """Merging t-digest for approximate quantiles (Dunning), with vectorized compression."""
+
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind='mergesort')
+        means = means[order]
+        weights = weights[order]
+        total = weights.sum()
+        # Map the cumulative weight at the left edge of each centroid through the
+        # k1 scale function; centroids falling in the same unit of k are merged
+        q = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        bins = np.floor(k - k.min()).astype(np.int64)
+        merged_weights = np.bincount(bins, weights=weights)
+        merged_sums = np.bincount(bins, weights=means * weights)
+        keep = merged_weights > 0
+        self.weights = merged_weights[keep]
+        self.means = merged_sums[keep] / self.weights
+
+    def update(self, values):
+        """Fold an array of non-null floats into the digest."""
+        if len(values) == 0:
+            return
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other):
+        if len(other.means) == 0:
+            return
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+
+    def quantile(self, q, min_value, max_value):
+        if len(self.means) == 0:
+            return np.nan
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        value = np.interp(q * self.weights.sum(), cumulative, self.means)
+        return float(min(max(value, min_value), max_value))
+
+
+class HyperLogLog:
+    """HyperLogLog distinct count estimator over pandas value hashes."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def update(self, values):
+        """Fold a Series of non-null values into the registers."""
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder = hashes & np.uint64(2 ** (64 - self.precision) - 1)
+        # Rank is the position of the leftmost set bit in the remaining 64 - p bits
+        bit_length = np.frexp(remainder.astype(np.float64))[1]
+        rank = (64 - self.precision - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m ** 2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class TopK:
+    """Mergeable frequent-values summary that keeps the 10 * k largest counts of each chunk."""
+
+    def __init__(self, k=TOP_K):
+        self.k = k
+        self.counts = pd.Series(dtype='float64')
+
+    def update(self, values):
+        """Fold a Series of non-null values into the summary."""
+        if len(values) == 0:
+            return
+        # factorize + bincount is several times faster than value_counts on string columns
+        codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+        counts = np.bincount(codes)
+        keep = min(len(counts), self.k * 10)
+        top = np.argpartition(-counts, keep - 1)[:keep]
+        counts = pd.Series(counts[top], index=np.asarray(uniques, dtype=object)[top].astype(str))
+        self._add(counts.groupby(level=0).sum())
+
+    def merge(self, other):
+        self._add(other.counts)
+
+    def _add(self, counts):
+        combined = self.counts.add(counts, fill_value=0)
+        self.counts = combined.nlargest(self.k * 10) if len(combined) > self.k * 10 else combined
+
+    def top(self):
+        if len(self.counts) == 0:
+            return None, 0
+        return self.counts.idxmax(), int(self.counts.max())
+
+
+class ColumnProfile:
+    """Mergeable profile of a single column, datetimes are profiled as int64 nanoseconds."""
+
+    def __init__(self, numeric, temporal=False):
+        self.numeric = numeric or temporal
+        self.temporal = temporal
+        self.timezone = None
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        if self.numeric:
+            self.moments = Welford()
+            self.digest = TDigest()
+            # Exact quartiles while the column has been profiled in one piece, as for in-memory frames
+            self.quantiles = None
+        else:
+            self.top_k = TopK()
+
+    def update(self, series):
+        first_update = self.count == 0 and self.nulls == 0
+        values = series.dropna()
+        self.count += len(values)
+        self.nulls += len(series) - len(values)
+        self.distinct.update(values)
+        if self.numeric:
+            if self.temporal:
+                timestamps = pd.DatetimeIndex(values).as_unit('ns')
+                self.timezone = timestamps.tz
+                values = timestamps.asi8
+            else:
+                values = values.to_numpy(dtype='float64')
+            self.moments.update(values)
+            self.digest.update(values)
+            self.quantiles = np.quantile(values, QUANTILES) if first_update and len(values) else None
+        else:
+            self.top_k.update(values)
+
+    def merge(self, other):
+        empty = self.count == 0 and self.nulls == 0
+        self.count += other.count
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if self.numeric:
+            self.timezone = self.timezone or other.timezone
+            self.moments.merge(other.moments)
+            self.digest.merge(other.digest)
+            self.quantiles = other.quantiles if empty else None
+        else:
+            self.top_k.merge(other.top_k)
+
+    def to_timestamp(self, nanoseconds):
+        return pd.Timestamp(int(round(nanoseconds)), tz=self.timezone)
+
+    def describe(self):
+        """Return the statistics df.describe(include='all') reports for this column."""
+        if self.temporal:
+            describe = {'count': self.count}
+            if self.count:
+                describe['mean'] = self.to_timestamp(self.moments.mean)
+                describe['min'] = self.to_timestamp(self.moments.min)
+                for index, q in enumerate(QUANTILES):
+                    if self.quantiles is not None:
+                        describe[f'{q:.0%}'] = self.to_timestamp(self.quantiles[index])
+                    else:
+                        describe[f'{q:.0%}'] = self.to_timestamp(self.digest.quantile(q, self.moments.min, self.moments.max))
+                describe['max'] = self.to_timestamp(self.moments.max)
+            return describe
+        if self.numeric:
+            describe = {'count': self.count}
+            if self.count:
+                describe['mean'] = self.moments.mean
+                describe['std'] = self.moments.std
+                describe['min'] = self.moments.min
+                for index, q in enumerate(QUANTILES):
+                    if self.quantiles is not None:
+                        describe[f'{q:.0%}'] = float(self.quantiles[index])
+                    else:
+                        describe[f'{q:.0%}'] = self.digest.quantile(q, self.moments.min, self.moments.max)
+                describe['max'] = self.moments.max
+            return describe
+        top, freq = self.top_k.top()
+        describe = {'count': self.count, 'unique': min(self.distinct.count(), self.count)}
+        if top is not None:
+            describe['top'] = top
+            describe['freq'] = freq
+        return describe
+
+
+def concat_samples(first, second):
+    """
+    Concatenate two samples of rows, keeping the dtypes of their non-missing values.
+
+    Empty samples are left out, and all-NA columns take the dtype of the other
+    sample, so the result does not depend on deprecated pandas dtype inference.
+    """
+    if second.empty:
+        return first
+    if first.empty:
+        return second
+    mismatched = [column for column in first.columns if first[column].dtype != second[column].dtype]
+    first = first.astype({column: second[column].dtype for column in mismatched if first[column].isna().all()})
+    second = second.astype({column: first[column].dtype for column in mismatched if second[column].isna().all()})
+    return pd.concat([first, second])
+
+
+class DatasetProfile:
+    """
+    One-pass, mergeable profile of a dataset.
+
+    Holds everything the system message and data dictionary need (describe()
+    statistics, missing values, first and last rows) so they are computed once
+    per dataset, and can be built up chunk by chunk for streamed uploads.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+        self.dtypes = None
+        self.head = None
+        self.tail = None
+
+    def update(self, chunk):
+        """Fold the next chunk of rows into the profile."""
+        if self.dtypes is None:
+            self.dtypes = chunk.dtypes
+        for column in chunk.columns:
+            if column not in self.columns:
+                dtype = chunk[column].dtype
+                numeric = pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+                temporal = pd.api.types.is_datetime64_any_dtype(dtype)
+                self.columns[column] = ColumnProfile(numeric, temporal)
+            self.columns[column].update(chunk[column])
+        self.head = chunk.head(SAMPLE_ROWS) if self.head is None else concat_samples(self.head, chunk.head(SAMPLE_ROWS)).head(SAMPLE_ROWS)
+        self.tail = chunk.tail(SAMPLE_ROWS) if self.tail is None else concat_samples(self.tail, chunk.tail(SAMPLE_ROWS)).tail(SAMPLE_ROWS)
+        self.rows += len(chunk)
+        return self
+
+    def merge(self, other):
+        """Merge the profile of the rows that follow this profile's rows."""
+        if self.dtypes is None:
+            self.dtypes = other.dtypes
+        for column, column_profile in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(column_profile)
+            else:
+                self.columns[column] = column_profile
+        self.head = other.head if self.head is None else concat_samples(self.head, other.head).head(SAMPLE_ROWS)
+        self.tail = other.tail if self.tail is None else concat_samples(self.tail, other.tail).tail(SAMPLE_ROWS)
+        self.rows += other.rows
+        return self
+
+    def replace_columns(self, other):
+        """Replace the profiles of the columns other holds, e.g. after their type was widened."""
+        self.columns.update(other.columns)
+        return self
+
+    @property
+    def shape(self):
+        return (self.rows, len(self.columns))
+
+    def describe(self):
+        """Return a frame shaped like df.describe(include='all')."""
+        index = ['count', 'unique', 'top', 'freq', 'mean', 'std', 'min'] + [f'{q:.0%}' for q in QUANTILES] + ['max']
+        describe = pd.DataFrame({column: column_profile.describe() for column, column_profile in self.columns.items()}, index=index)
+        return describe.dropna(how='all')
+
+    def missing_values(self):
+        return pd.Series({column: column_profile.nulls for column, column_profile in self.columns.items()})
+
+
+def profile_dataframe(df):
+    """Build the profile of an in-memory DataFrame."""
+    return DatasetProfile().update(df)
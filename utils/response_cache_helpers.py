@@ -0,0 +1,153 @@
+import re
+import copy
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from utils.artifact_helpers import artifact_store, is_artifact
+from utils.result_helpers import SESSION_VARIABLES_HEADER
+
+# Number of cached answers, least recently used ones are evicted beyond it
+RESPONSE_CACHE_SIZE = 256
+
+# Seconds a cached answer is replayed for
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+
+# Also replay answers to differently worded questions whose embeddings are this similar; None turns it off
+RESPONSE_CACHE_SIMILARITY = 0.95
+
+
+def normalize_question(question):
+    """Lowercase a question and drop punctuation and repeated whitespace, so trivially different wordings share a key."""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', question.lower()).split())
+
+
+def artifacts_available(messages):
+    """Check that every plot a cached answer refers to is still in the artifact store."""
+    for message in messages:
+        if message.get('type') == 'function_call_output' and isinstance(message['output'], list):
+            for item in message['output']:
+                if is_artifact(item.get('image_url')) and artifact_store.get(item['image_url'])[0] is None:
+                    return False
+    return True
+
+
+def strip_session_variables(message):
+    """Drop the session variable list from a tool output, a session replaying the answer does not have them."""
+    if message.get('type') == 'function_call_output' and isinstance(message['output'], str):
+        return {**message, 'output': message['output'].partition(SESSION_VARIABLES_HEADER)[0]}
+    return message
+
+
+class ResponseCache:
+    """
+    Process-wide cache of agent answers to the first question of a conversation.
+
+    Many users ask the same opening questions (the sample buttons) of the same
+    sample datasets, and each pays for a full agent loop. Answers are cached
+    under a scope, the model plus the dataset fingerprints and data dictionary
+    version, and the normalized question; on a miss, an answer to a question
+    with a similar embedding in the same scope is used. Only first questions
+    are cached, later answers depend on the earlier turns.
+    """
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.size = size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _key(self, scope, question):
+        return hashlib.sha256(f'{scope}\n{normalize_question(question)}'.encode()).hexdigest()
+
+    def _valid(self, key, entry):
+        if time.time() - entry['created'] > self.ttl or not artifacts_available(entry['messages']):
+            logging.info(f'Evicting cached response {key}')
+            del self.entries[key]
+            return False
+        return True
+
+    def lookup(self, scope, question, embed=None):
+        """
+        Find a cached answer to a question.
+
+        Args:
+            scope (str): The model and datasets the question is about
+            question (str): The user's question
+            embed (callable): Returns the embedding of a text, None skips the similarity lookup
+
+        Returns:
+            tuple: (messages, context_window_usage, embedding) - messages is None on a miss,
+                embedding is the question's embedding if one was computed, to pass on to put
+        """
+        key = self._key(scope, question)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._valid(key, entry):
+                self.entries.move_to_end(key)
+                logging.info(f'Response cache hit for {key}')
+                return copy.deepcopy(entry['messages']), entry['context_window_usage'], entry['embedding']
+            candidates = [candidate_key for candidate_key, candidate in self.entries.items() if candidate['scope'] == scope and candidate['embedding'] is not None]
+
+        # Only pay for an embedding when there is something in scope to compare it with
+        if embed is None or self.similarity is None or not candidates:
+            return None, None, None
+        try:
+            embedding = np.asarray(embed(question), dtype='float32')
+        except Exception as e:
+            logging.warning(f'Could not embed the question for the response cache: {str(e)}')
+            return None, None, None
+
+        best_key, best_similarity = None, self.similarity
+        with self.lock:
+            for candidate_key in candidates:
+                candidate = self.entries.get(candidate_key)
+                if candidate is None:
+                    continue
+                similarity = float(np.dot(embedding, candidate['embedding']) / (np.linalg.norm(embedding) * np.linalg.norm(candidate['embedding'])))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = candidate_key, similarity
+            if best_key is not None and self._valid(best_key, self.entries[best_key]):
+                self.entries.move_to_end(best_key)
+                logging.info(f'Response cache hit for {best_key} by similarity {best_similarity:.3f}')
+                entry = self.entries[best_key]
+                return copy.deepcopy(entry['messages']), entry['context_window_usage'], embedding
+        return None, None, embedding
+
+    def put(self, scope, question, messages, context_window_usage, embedding=None, embed=None):
+        """
+        Cache the answer to a question.
+
+        Args:
+            scope (str): The model and datasets the question is about
+            question (str): The user's question
+            messages (list): The items the agent added after the question
+            context_window_usage (float): The context window usage of the answer
+            embedding: The question's embedding from lookup, for the similarity lookup
+            embed (callable): Embeds the question if lookup did not
+        """
+        key = self._key(scope, question)
+        if embedding is None and embed is not None and self.similarity is not None:
+            try:
+                embedding = embed(question)
+            except Exception as e:
+                logging.warning(f'Could not embed the question for the response cache: {str(e)}')
+        entry = {
+            'scope': scope,
+            'messages': [strip_session_variables(message) for message in copy.deepcopy(messages)],
+            'context_window_usage': context_window_usage,
+            'embedding': None if embedding is None else np.asarray(embedding, dtype='float32'),
+            'created': time.time(),
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,280 @@
+import io
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+from utils.token_helpers import encoding, count_tokens
+
+# Significant digits floats are rounded to in tool results, the model gains nothing from more
+RESULT_SIGNIFICANT_DIGITS = 6
+
+# Formats tried for tabular tool results, the one with the fewest tokens is sent.
+# 'index' is the original row-oriented JSON, which still wins for tiny results.
+RESULT_FORMATS = ['csv', 'tsv', 'split', 'markdown', 'index']
+
+# First line of every tabular tool result, naming its format; only results starting with it are shown as tables
+RESULT_TABLE_HEADER = 'Table ({result_format}):\n'
+
+# Sent instead of a table for results without rows or columns, which every format would encode to a bare header
+RESULT_EMPTY_TABLE = 'Empty result ({rows:,} rows; columns: {columns})'
+
+# Separates a tool result from the list of session variables appended to it
+SESSION_VARIABLES_HEADER = '\n\nVariables available to later tool calls:\n'
+
+# Token budget of a tool result, larger results are shaped or truncated to fit
+RESULT_TOKEN_LIMIT = 5000
+
+# Separates a shaped table from the notes on what was left out of it
+RESULT_NOTES_HEADER = '\n\nResult shortened to fit the token budget:\n'
+
+# Columns kept in a shaped table, the names of the others are listed
+RESULT_MAX_COLUMNS = 40
+
+# Fewest head and tail rows kept before columns are dropped to fit the budget
+RESULT_MIN_ROWS = 5
+
+# Rows encoded to estimate the tokens per row of a table
+RESULT_SAMPLE_ROWS = 20
+
+
+def truncate_text(text, token_limit=RESULT_TOKEN_LIMIT):
+    """Cut a text to token_limit tokens, noting how much was left out."""
+    # Tokens average about four characters, so only this prefix needs encoding
+    tokens = encoding.encode(text[:token_limit * 8])
+    if len(tokens) <= token_limit and len(text) <= token_limit * 8:
+        return text
+    kept = encoding.decode(tokens[:token_limit - 50])
+    return f'{kept}\n\n[Result truncated to its first {token_limit - 50} tokens, {len(text) - len(kept):,} characters omitted]'
+
+
+def round_floats(df):
+    """Round the float columns of a frame to RESULT_SIGNIFICANT_DIGITS significant digits."""
+    float_columns = df.select_dtypes(include='floating').columns
+    if len(float_columns) == 0:
+        return df
+    df = df.copy()
+    for column in float_columns:
+        values = df[column].to_numpy(dtype='float64', na_value=np.nan)
+        magnitude = np.floor(np.log10(np.abs(np.where(np.isfinite(values) & (values != 0), values, 1))))
+        scale = 10.0 ** (RESULT_SIGNIFICANT_DIGITS - 1 - magnitude)
+        df[column] = np.round(values * scale) / scale
+    return df
+
+
+def needs_index(df):
+    """A default RangeIndex carries no information and is left out."""
+    return not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f'{value:.{RESULT_SIGNIFICANT_DIGITS}g}'
+    return str(value)
+
+
+def to_csv(df, sep=','):
+    return df.to_csv(sep=sep, index=needs_index(df), float_format=f'%.{RESULT_SIGNIFICANT_DIGITS}g', lineterminator='\n').rstrip('\n')
+
+
+def to_split(df):
+    return df.to_json(orient='split', index=needs_index(df), date_format='iso')
+
+
+def to_markdown(df):
+    if needs_index(df):
+        df = df.reset_index()
+    lines = [
+        '|' + '|'.join(str(column) for column in df.columns) + '|',
+        '|' + '|'.join('-' for _ in df.columns) + '|',
+    ]
+    for row in df.itertuples(index=False):
+        lines.append('|' + '|'.join(format_value(value).replace('|', '\\|') for value in row) + '|')
+    return '\n'.join(lines)
+
+
+ENCODERS = {
+    'csv': to_csv,
+    'tsv': lambda df: to_csv(df, sep='\t'),
+    'split': to_split,
+    'markdown': to_markdown,
+    'index': lambda df: df.to_json(orient='index'),
+}
+
+
+def from_csv(text, sep=','):
+    df = pd.read_csv(io.StringIO(text), sep=sep)
+    # An unnamed index is written with an empty header
+    if len(df.columns) and str(df.columns[0]).startswith('Unnamed: 0'):
+        df = df.set_index(df.columns[0]).rename_axis(None)
+    return df
+
+
+def from_markdown(text):
+    lines = text.splitlines()
+    rows = [[cell.replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line.strip('|'))] for line in lines[:1] + lines[2:]]
+    return pd.DataFrame(rows[1:], columns=rows[0])
+
+
+DECODERS = {
+    'csv': from_csv,
+    'tsv': lambda text: from_csv(text, sep='\t'),
+    'split': lambda text: pd.read_json(io.StringIO(text), orient='split'),
+    'markdown': from_markdown,
+    'index': lambda text: pd.read_json(io.StringIO(text), orient='index'),
+}
+
+
+def to_frame(result):
+    """Convert a DataFrame, Series, dict or list result to a DataFrame."""
+    if isinstance(result, pd.DataFrame):
+        return result
+    if isinstance(result, pd.Series):
+        return result.to_frame()
+    if isinstance(result, dict):
+        return pd.DataFrame.from_dict(result, orient='index')
+    return pd.DataFrame(result)
+
+
+def head_tail(df, rows):
+    """The first and last rows // 2 rows of a frame."""
+    if len(df) <= rows:
+        return df
+    return pd.concat([df.iloc[:rows - rows // 2], df.iloc[len(df) - rows // 2:]])
+
+
+def summarize_numeric(df):
+    """Summary statistics of the numeric columns, computed over all rows."""
+    numeric = df.select_dtypes(include='number')
+    if numeric.shape[1] == 0:
+        return None
+    return round_floats(numeric.describe().astype('float64'))
+
+
+def shape_frame(df, token_limit=RESULT_TOKEN_LIMIT):
+    """
+    Cut a frame down to what fits a token budget, keeping the useful part.
+
+    Columns beyond RESULT_MAX_COLUMNS are dropped, then the head and tail rows
+    that fit are kept and the numeric columns are summarized over all rows.
+    Only the kept rows are ever encoded, so the cost does not grow with the
+    size of the frame.
+
+    Args:
+        df (pd.DataFrame): The result
+        token_limit (int): The token budget
+
+    Returns:
+        tuple: (df, notes) - the shaped frame and notes on what was left out
+    """
+    notes = []
+    if df.shape[1] > RESULT_MAX_COLUMNS:
+        omitted = [str(column) for column in df.columns[RESULT_MAX_COLUMNS:]]
+        notes.append(f'{len(omitted):,} more columns omitted: {", ".join(omitted[:RESULT_MAX_COLUMNS])}{", ..." if len(omitted) > RESULT_MAX_COLUMNS else ""}')
+        df = df.iloc[:, :RESULT_MAX_COLUMNS]
+
+    sample = round_floats(df.head(RESULT_SAMPLE_ROWS))
+    tokens_per_row = max(count_tokens(to_csv(sample)) / max(len(sample), 1), 1)
+    # Leave room for the header, the notes and the choice of format
+    budget = int(token_limit * 0.9) - count_tokens('\n'.join(notes))
+    if len(df) * tokens_per_row <= budget:
+        return df, notes
+
+    summary = summarize_numeric(df)
+    if summary is not None:
+        summary_text = to_csv(summary)
+        summary_tokens = count_tokens(summary_text, budget // 3)
+        if summary_tokens <= budget // 3:
+            budget -= summary_tokens
+        else:
+            summary = None
+
+    rows = min(int(budget / tokens_per_row), len(df))
+    while True:
+        if rows < 2 * RESULT_MIN_ROWS and df.shape[1] > 1:
+            # Rows are too wide to show enough of them, keep fewer columns
+            columns = max(df.shape[1] // 2, 1)
+            notes.append(f'{df.shape[1] - columns:,} more columns omitted to fit the rows: {", ".join(str(column) for column in df.columns[columns:])}')
+            df = df.iloc[:, :columns]
+            rows = 2 * RESULT_MIN_ROWS
+        shaped = head_tail(df, max(rows, 1))
+        tokens = count_tokens(to_csv(round_floats(shaped)), budget)
+        if tokens <= budget or rows <= 1:
+            break
+        rows = int(rows * budget / tokens * 0.95)
+
+    if len(shaped) < len(df):
+        notes.append(f'{len(df) - len(shaped):,} of {len(df):,} rows omitted, showing the first {len(shaped) - len(shaped) // 2} and last {len(shaped) // 2}')
+    if summary is not None:
+        notes.append(f'Summary of the numeric columns over all {len(df):,} rows:\n{summary_text}')
+    return shaped, notes
+
+
+def encode_result(result, formats=RESULT_FORMATS, token_limit=RESULT_TOKEN_LIMIT):
+    """
+    Serialize a tabular tool result in the format that costs the fewest tokens.
+
+    Row-oriented JSON (to_json(orient='index')) repeats every column name on
+    every row; CSV/TSV, split JSON and markdown tables state them once.
+    Results above token_limit are shaped with shape_frame instead of being
+    sent whole, and the notes on what was left out follow RESULT_NOTES_HEADER.
+    The result starts with RESULT_TABLE_HEADER, so the UI knows it is a table.
+    Empty results are described with RESULT_EMPTY_TABLE instead.
+
+    Args:
+        result: A DataFrame, Series, dict or list
+        formats (list): The candidate formats, keys of ENCODERS
+        token_limit (int): The token budget, None sends the whole result
+
+    Returns:
+        str: The encoded result
+    """
+    df = to_frame(result)
+    if df.empty:
+        columns = ', '.join(str(column) for column in df.columns[:RESULT_MAX_COLUMNS]) or 'none'
+        if df.shape[1] > RESULT_MAX_COLUMNS:
+            columns += ', ...'
+        return RESULT_EMPTY_TABLE.format(rows=len(df), columns=columns)
+    notes = []
+    if token_limit is not None:
+        df, notes = shape_frame(df, token_limit)
+    df = round_floats(df)
+    best_text, best_tokens, best_format = None, None, None
+    for result_format in formats:
+        try:
+            text = ENCODERS[result_format](df)
+        except Exception as e:
+            logging.warning(f'Could not encode result as {result_format}: {str(e)}')
+            continue
+        tokens = count_tokens(text, best_tokens)
+        if best_tokens is None or tokens < best_tokens:
+            best_text, best_tokens, best_format = text, tokens, result_format
+    if best_text is None:
+        best_text, best_format = df.to_json(orient='index'), 'index'
+    logging.info(f'Encoded result as {best_format} in {best_tokens} tokens')
+    best_text = RESULT_TABLE_HEADER.format(result_format=best_format) + best_text
+    if notes:
+        logging.info(f'Shaped result to fit {token_limit} tokens: {notes[0]}')
+        best_text += RESULT_NOTES_HEADER + '\n'.join(notes)
+    return best_text
+
+
+def decode_result(text):
+    """
+    Parse a tabular tool result from encode_result back into a DataFrame for display.
+
+    Args:
+        text (str): The tool result, without the session variables and notes
+
+    Returns:
+        pd.DataFrame or None: The table, or None if the text is not a table encode_result made
+    """
+    for result_format, decoder in DECODERS.items():
+        header = RESULT_TABLE_HEADER.format(result_format=result_format)
+        if text.startswith(header):
+            try:
+                return decoder(text[len(header):])
+            except (pd.errors.ParserError, ValueError, IndexError) as e:
+                logging.warning(f'Could not decode a {result_format} table: {str(e)}')
+                return None
+    return None
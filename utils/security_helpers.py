@@ -1,9 +1,20 @@
 import streamlit as st
 import threading
+import multiprocessing
+import pickle
+import os
+import atexit
+import tempfile
+import sys
+import time
+import types
+import dis
 import ast
 import logging
 import traceback
+import hashlib
 from io import StringIO
+from collections import OrderedDict
 from contextlib import redirect_stdout, redirect_stderr
 
 # Common data science libraries
@@ -16,24 +27,120 @@ import datetime
 import warnings
 import math
 import statsmodels as sm
+import pyarrow as pa
+
+from utils.ingestion_helpers import STRING_DTYPE, store_to_pandas
+
+# 'process' runs generated code in a pool of pre-forked worker processes that can be
+# killed on timeout, 'thread' runs it in a daemon thread of the Streamlit process
+SANDBOX_BACKEND = 'process' if os.name == 'posix' else 'thread'
+
+# Number of warm worker processes shared by all sessions
+SANDBOX_WORKERS = 4
+
+# Address space a single execution may add to its worker, on top of the interpreter,
+# the mapped datasets and the session namespaces the worker already holds
+SANDBOX_MEMORY_LIMIT = 4 * 1024 * 1024 * 1024  # 4GB
+
+# Largest result a single execution may return, measured pickled
+SANDBOX_RESULT_LIMIT = 50 * 1024 * 1024  # 50MB
+
+# Most memory blocks a single execution may leave allocated, a sign of Python-level loops over rows.
+# Not applied to executions in a session namespace, whose variables are kept on purpose
+SANDBOX_OBJECT_LIMIT = 5_000_000
+
+# Datasets are handed to the workers as memory-mapped Arrow IPC files in this directory
+SANDBOX_DATASET_DIR = os.path.join(tempfile.gettempdir(), 'arctic_analytics', 'sandbox')
+
+# Disk budget for the published datasets, least recently used files are removed beyond it
+SANDBOX_DATASET_BUDGET = 4 * 1024 * 1024 * 1024  # 4GB
+
+# Number of datasets each worker keeps mapped
+SANDBOX_WORKER_DATASETS = 8
+
+# Pandas dtypes of the string columns of a published dataset. They wrap the mapped pages without
+# copying; the pandas metadata of the file restores every other column, see load_published_dataset
+SANDBOX_STRING_DTYPES = {
+    pa.string(): STRING_DTYPE,
+    pa.large_string(): STRING_DTYPE,
+}
+
+# Number of validated and compiled snippets kept per process
+CODE_CACHE_SIZE = 256
+
+# Memory cap of the variables a session keeps between tool calls, least recently used ones are dropped beyond it
+SESSION_KERNEL_MEMORY_LIMIT = 512 * 1024 * 1024  # 512MB
+
+# Only variables at least this large are dropped to stay within the memory cap
+SESSION_KERNEL_LARGE_VARIABLE = 1024 * 1024  # 1MB
+
+# Number of session namespaces each process keeps
+SESSION_KERNELS_PER_PROCESS = 16
 
 class SecurityError(Exception):
     """Exception raised for security violations in code execution."""
     pass
 
-def validate_code_security(python_syntax):
+class ResourceLimitError(Exception):
+    """Exception raised when code execution exceeds a sandbox resource limit."""
+    pass
+
+def format_bytes(size):
+    return f"{size / 1024 / 1024:.1f}MB" if size < 1024 ** 3 else f"{size / 1024 ** 3:.1f}GB"
+
+def reset_peak_memory():
+    """Reset the peak resident memory of this process so the next execution can be measured on its own (Linux)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes since the last reset_peak_memory."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def address_space():
+    """Return the address space of this process in bytes, 0 where it cannot be read (Linux)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return 0
+
+def check_resource_usage(usage, limit_objects=True):
     """
-    Validate the security of Python code before execution.
+    Enforce the limits that can only be checked once code has finished.
     
     Args:
-        python_syntax (str): The Python code to validate
+        usage (dict): The measurements of the execution
+        limit_objects (bool): Whether to enforce SANDBOX_OBJECT_LIMIT, off when the code ran in a session namespace
         
-    Returns:
-        None: If code passes security checks
+    Raises:
+        ResourceLimitError: If the result or the allocated objects exceed their limits
+    """
+    if usage.get('result_bytes', 0) > SANDBOX_RESULT_LIMIT:
+        raise ResourceLimitError(f"The result is {format_bytes(usage['result_bytes'])}, above the limit of {format_bytes(SANDBOX_RESULT_LIMIT)}. Return an aggregate, a filtered subset or the first rows instead of the full data.")
+    if limit_objects and usage.get('allocated_blocks', 0) > SANDBOX_OBJECT_LIMIT:
+        raise ResourceLimitError(f"The code left {usage['allocated_blocks']:,} Python objects allocated, above the limit of {SANDBOX_OBJECT_LIMIT:,}. Use vectorized pandas or numpy operations instead of building Python lists, dicts or loops over rows.")
+
+def check_ast_security(parsed_ast):
+    """
+    Check a parsed snippet for imports and calls that are not allowed.
+    
+    Args:
+        parsed_ast (ast.Module): The parsed Python code
         
     Raises:
         SecurityError: If code contains potentially dangerous operations
-        SyntaxError: If code has syntax errors
     """
     # Whitelist of allowed modules
     allowed_modules = {
@@ -52,36 +159,98 @@ def validate_code_security(python_syntax):
     # Still maintain the blacklist for dangerous functions
     forbidden_functions = ['eval', 'exec', 'compile', 'open', 'input', '__import__', 'globals']
     
-    # Parse the code to check for security issues
+    # Check for imports
+    for node in ast.walk(parsed_ast):
+        if isinstance(node, ast.Import):
+            for name in node.names:
+                # Check if the module being imported is in the allowed list
+                module_parts = name.name.split('.')
+                base_module = module_parts[0]
+                if base_module not in allowed_modules:
+                    raise SecurityError(f"Import of module '{name.name}' is not allowed. Only whitelisted modules can be used.")
+                    
+        elif isinstance(node, ast.ImportFrom):
+            # Check if the module being imported from is in the allowed list
+            if node.module:
+                module_parts = node.module.split('.')
+                base_module = module_parts[0]
+                if base_module not in allowed_modules:
+                    raise SecurityError(f"Import from module '{node.module}' is not allowed. Only whitelisted modules can be used.")
+        
+        # Check for dangerous function calls
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id in forbidden_functions:
+                raise SecurityError(f"Use of potentially dangerous function '{node.func.id}' is not allowed")
+            elif isinstance(node.func, ast.Attribute) and node.func.attr in forbidden_functions:
+                raise SecurityError(f"Use of potentially dangerous method '{node.func.attr}' is not allowed")
+
+compiled_code_cache = OrderedDict()
+compiled_code_cache_lock = threading.Lock()
+
+def compile_code(python_syntax):
+    """
+    Parse, validate and compile a snippet once, caching the result by source hash.
+    
+    Agents often re-run the same snippet after an error, so the verdict and
+    code object are kept and the snippet is never parsed or compiled again.
+    
+    Args:
+        python_syntax (str): The Python code to compile
+        
+    Returns:
+        dict: {'error': (exception_type, message) or None,
+               'expression': True if the code is a single expression,
+               'code': The compiled code object, or None if validation failed,
+               'names': The global names the code refers to,
+               'stores': The global names the code assigns or deletes}
+    """
+    key = hashlib.sha256(python_syntax.encode('utf-8')).hexdigest()
+    with compiled_code_cache_lock:
+        if key in compiled_code_cache:
+            compiled_code_cache.move_to_end(key)
+            return compiled_code_cache[key]
+    
+    compiled = {'error': None, 'expression': False, 'code': None, 'names': set(), 'stores': set()}
     try:
         parsed_ast = ast.parse(python_syntax)
-        
-        # Check for imports
-        for node in ast.walk(parsed_ast):
-            if isinstance(node, ast.Import):
-                for name in node.names:
-                    # Check if the module being imported is in the allowed list
-                    module_parts = name.name.split('.')
-                    base_module = module_parts[0]
-                    if base_module not in allowed_modules:
-                        raise SecurityError(f"Import of module '{name.name}' is not allowed. Only whitelisted modules can be used.")
-                        
-            elif isinstance(node, ast.ImportFrom):
-                # Check if the module being imported from is in the allowed list
-                if node.module:
-                    module_parts = node.module.split('.')
-                    base_module = module_parts[0]
-                    if base_module not in allowed_modules:
-                        raise SecurityError(f"Import from module '{node.module}' is not allowed. Only whitelisted modules can be used.")
-            
-            # Check for dangerous function calls
-            if isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name) and node.func.id in forbidden_functions:
-                    raise SecurityError(f"Use of potentially dangerous function '{node.func.id}' is not allowed")
-                elif isinstance(node.func, ast.Attribute) and node.func.attr in forbidden_functions:
-                    raise SecurityError(f"Use of potentially dangerous method '{node.func.attr}' is not allowed")
+        check_ast_security(parsed_ast)
+        compiled['expression'] = len(parsed_ast.body) == 1 and isinstance(parsed_ast.body[0], ast.Expr)
+        if compiled['expression']:
+            compiled['code'] = compile(ast.Expression(parsed_ast.body[0].value), '<string>', 'eval')
+        else:
+            compiled['code'] = compile(parsed_ast, '<string>', 'exec')
+        compiled['names'] = referenced_names(compiled['code'])
+        compiled['stores'] = stored_names(compiled['code'])
+    except SecurityError as e:
+        compiled['error'] = (SecurityError, str(e))
     except SyntaxError as e:
-        raise SyntaxError(f"Invalid code: {str(e)}")
+        compiled['error'] = (SyntaxError, f"Invalid code: {str(e)}")
+    
+    with compiled_code_cache_lock:
+        compiled_code_cache[key] = compiled
+        if len(compiled_code_cache) > CODE_CACHE_SIZE:
+            compiled_code_cache.popitem(last=False)
+    return compiled
+
+def validate_code_security(python_syntax):
+    """
+    Validate the security of Python code before execution.
+    
+    Args:
+        python_syntax (str): The Python code to validate
+        
+    Returns:
+        None: If code passes security checks
+        
+    Raises:
+        SecurityError: If code contains potentially dangerous operations
+        SyntaxError: If code has syntax errors
+    """
+    error = compile_code(python_syntax)['error']
+    if error:
+        # Raise a fresh exception so cached verdicts do not accumulate tracebacks
+        error_type, message = error
+        raise error_type(message)
         
     return None
 
@@ -114,31 +283,55 @@ def create_safe_execution_environment(vetted_files):
     # Add the dataframes from vetted files to the globals
     for filename in vetted_files:
         df_name = filename
-        safe_globals[df_name] = vetted_files[filename]['dataframe'].copy()
+        # Zero-copy view; Copy-on-Write keeps writes away from the master copy
+        safe_globals[df_name] = vetted_files[filename]['dataframe'].copy(deep=False)
     
     # Add a function to get original filenames directly from vetted_files
     safe_globals['get_dataframe_names'] = lambda: list(vetted_files.keys())
     
     return safe_globals
 
-def is_expression(code):
+def run_code(code, globals_dict, report_function):
     """
-    Check if code is a single expression that can be evaluated.
+    Execute code in the given environment and capture its output.
     
     Args:
-        code (str): The Python code to check
+        code (str): The Python code to execute
+        globals_dict (dict): The global environment for execution
+        report_function (str): The name of the function to call for the result
         
     Returns:
-        bool: True if code is a single expression, False otherwise
+        tuple: (result, stdout_output)
     """
-    try:
-        parsed = ast.parse(code)
-        return (len(parsed.body) == 1 and 
-                isinstance(parsed.body[0], ast.Expr))
-    except SyntaxError:
-        return False
+    result = None
+    output_buffer = StringIO()
+    compiled = compile_code(code)
+    if compiled['error']:
+        error_type, message = compiled['error']
+        raise error_type(message)
+    # Execute the code in the restricted environment
+    with redirect_stdout(output_buffer), redirect_stderr(output_buffer):
+        # Check if code is a single expression that can be evaluated directly
+        if compiled['expression']:
+            result = eval(compiled['code'], globals_dict)
+        else:
+            exec(compiled['code'], globals_dict)
+            # Only try to call the report function if we executed statements
+            if report_function:
+                result = eval(f'{report_function}()', globals_dict)
+    return result, output_buffer.getvalue()
 
-def execute_with_timeout(code, globals_dict, report_function, timeout_sec=10):
+def log_resource_usage(usage):
+    """Record the resource measurements of an execution in the tool-call log."""
+    measurements = [f"wall {usage['wall_seconds']:.3f}s", f"cpu {usage['cpu_seconds']:.3f}s"]
+    if 'peak_memory_bytes' in usage:
+        measurements.append(f"peak memory {format_bytes(usage['peak_memory_bytes'])}")
+    measurements.append(f"allocated blocks {usage['allocated_blocks']:,}")
+    if 'result_bytes' in usage:
+        measurements.append(f"result {format_bytes(usage['result_bytes'])}")
+    logging.info(f"Sandbox resource usage - {', '.join(measurements)}")
+
+def execute_with_timeout(code, globals_dict, report_function, timeout_sec=10, limit_objects=True):
     """
     Execute code with a timeout to prevent infinite loops or resource exhaustion.
     
@@ -147,34 +340,33 @@ def execute_with_timeout(code, globals_dict, report_function, timeout_sec=10):
         globals_dict (dict): The global environment for execution
         report_function (str): The name of the function to call for the result
         timeout_sec (int): Maximum execution time in seconds
+        limit_objects (bool): Whether to enforce SANDBOX_OBJECT_LIMIT, see check_resource_usage
         
     Returns:
         tuple: (result, stdout_output)
         
     Raises:
         TimeoutError: If code execution exceeds the timeout
+        ResourceLimitError: If the result or the allocated objects exceed their limits
         Exception: Any exception raised during code execution
     """
     result = [None]
     error = [None]
-    output_buffer = StringIO()
+    stdout_output = [None]
+    
+    cpu_seconds = [0.0]
     
     def target():
+        cpu_start = time.thread_time()
         try:
-            # Execute the code in the restricted environment
-            with redirect_stdout(output_buffer), redirect_stderr(output_buffer):
-                # Check if code is a single expression that can be evaluated directly
-                if is_expression(code):
-                    result[0] = eval(code, globals_dict)
-                else:
-                    exec(code, globals_dict)
-                    # Only try to call the report function if we executed statements
-                    if report_function:
-                        result[0] = eval(f'{report_function}()', globals_dict)
+            result[0], stdout_output[0] = run_code(code, globals_dict, report_function)
         except Exception as e:
             error[0] = e
+        cpu_seconds[0] = time.thread_time() - cpu_start
     
     # Start the execution in a separate thread that we can timeout
+    blocks_start = sys.getallocatedblocks()
+    wall_start = time.perf_counter()
     thread = threading.Thread(target=target)
     thread.daemon = True
     thread.start()
@@ -184,12 +376,525 @@ def execute_with_timeout(code, globals_dict, report_function, timeout_sec=10):
         # If the thread is still running after the timeout
         raise TimeoutError(f"Code execution timed out after {timeout_sec} seconds")
     
+    # Threads share the process, so only CPU time, objects and result size can be measured per execution
+    usage = {
+        'wall_seconds': time.perf_counter() - wall_start,
+        'cpu_seconds': cpu_seconds[0],
+        'allocated_blocks': sys.getallocatedblocks() - blocks_start,
+        'result_bytes': variable_size(result[0]),
+    }
+    log_resource_usage(usage)
+    
     if error[0]:
         raise error[0]
+    check_resource_usage(usage, limit_objects)
         
-    return result[0], output_buffer.getvalue()
+    return result[0], stdout_output[0]
+
+def referenced_names(code_object):
+    """Return the global names a code object and its nested functions refer to."""
+    names = set(code_object.co_names)
+    for constant in code_object.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= referenced_names(constant)
+    return names
+
+def stored_names(code_object):
+    """Return the global names a code object and its nested functions assign or delete."""
+    names = {
+        instruction.argval for instruction in dis.get_instructions(code_object)
+        if instruction.opname in ('STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME', 'DELETE_GLOBAL')
+    }
+    for constant in code_object.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= stored_names(constant)
+    return names
 
-def safely_execute_code(python_syntax, vetted_files, report_function):
+def variable_size(value):
+    """Estimate the memory held by a session variable in bytes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+def describe_variable(name, value):
+    """Return a one-line description of a session variable for the model."""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return f"{name}: {type(value).__name__} of shape {value.shape}"
+    return f"{name}: {type(value).__name__}"
+
+class SessionKernel:
+    """
+    Persistent namespace of one session's generated code.
+    
+    Variables assigned by earlier tool calls stay available to later ones, so
+    expensive intermediates (merges, groupbys, pivots) are computed once. The
+    libraries and dataframes are re-applied before every call, so reassigning
+    them only lasts for that call. Once the variables exceed the memory cap,
+    the least recently used large ones are dropped.
+    """
+    
+    def __init__(self, memory_limit=SESSION_KERNEL_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.namespace = {}
+        self.last_used = {}
+        self.clock = 0
+    
+    def prepare(self, safe_globals):
+        """Return the namespace to execute the next snippet in."""
+        self.namespace.update(safe_globals)
+        return self.namespace
+    
+    def update(self, safe_globals, code):
+        """
+        Record which variables the snippet used and evict beyond the memory cap.
+        
+        Returns:
+            dict: Descriptions of the variables available to later calls, by name
+        """
+        self.clock += 1
+        compiled = compile_code(code)
+        used_names = compiled['names']
+        
+        variables = {
+            name: value for name, value in self.namespace.items()
+            if name not in safe_globals and not name.startswith('__')
+            and not isinstance(value, (types.ModuleType, types.FunctionType, type))
+        }
+        for name in variables:
+            if name in used_names or name not in self.last_used:
+                self.last_used[name] = self.clock
+        self.last_used = {name: self.last_used[name] for name in variables}
+        
+        sizes = {name: variable_size(value) for name, value in variables.items()}
+        total_size = sum(sizes.values())
+        large_variables = [name for name in variables if sizes[name] >= SESSION_KERNEL_LARGE_VARIABLE]
+        for name in sorted(large_variables, key=lambda name: self.last_used[name]):
+            if total_size <= self.memory_limit:
+                break
+            logging.info(f"Dropping session variable {name} ({sizes[name]} bytes) to stay within the memory cap")
+            total_size -= sizes[name]
+            del self.namespace[name]
+            del self.last_used[name]
+            del variables[name]
+        
+        return {name: describe_variable(name, value) for name, value in variables.items()}
+
+def get_session_kernel(kernels, session_id):
+    """
+    Return the kernel of a session from an LRU of kernels, creating it if needed.
+    
+    Returns:
+        tuple: (kernel, evicted_session_id) - the session whose kernel was evicted to make room, or None
+    """
+    evicted_session_id = None
+    if session_id not in kernels:
+        kernels[session_id] = SessionKernel()
+        if len(kernels) > SESSION_KERNELS_PER_PROCESS:
+            evicted_session_id, _ = kernels.popitem(last=False)
+    kernels.move_to_end(session_id)
+    return kernels[session_id], evicted_session_id
+
+def load_published_dataset(path, dtypes):
+    """
+    Load a published dataset in a worker with the dtypes of the vetted dataframe.
+    
+    Columns whose dtype does not survive the round trip through Arrow, e.g.
+    Python-backed strings or object columns, are cast back, so generated code
+    sees the same frame as on the thread backend and in the data dictionary.
+    
+    Args:
+        path (str): The path of the published file
+        dtypes (pd.Series): The dtypes of the vetted dataframe
+        
+    Returns:
+        pd.DataFrame: The dataset
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    if table.schema.pandas_metadata is None:
+        # A linked streamed store, converted like at ingestion
+        df = store_to_pandas(table)
+    else:
+        df = table.to_pandas(types_mapper=SANDBOX_STRING_DTYPES.get)
+    mismatched_dtypes = {column: dtype for column, dtype in dtypes.items() if df[column].dtype != dtype}
+    if mismatched_dtypes:
+        df = df.astype(mismatched_dtypes)
+    return df
+
+def sandbox_worker(connection, memory_limit):
+    """
+    Main loop of a sandbox worker process.
+    
+    Receives {'type': 'execute', 'code', 'report_function', 'dataset_paths',
+    'dataset_dtypes', 'session_id'} requests, executes them and sends back
+    (('ok', (result, stdout_output)) or ('error', (exception, traceback)) pickled,
+    variables, evicted_session_id, usage), evicted_session_id being a session
+    whose namespace was dropped to make room. {'type': 'release', 'session_id'}
+    requests drop the session's namespace and get no response.
+    
+    Args:
+        connection: The worker end of the pipe to the Streamlit process
+        memory_limit (int): Address space an execution may add to the worker in bytes
+    """
+    import resource
+    _, hard_memory_limit = resource.getrlimit(resource.RLIMIT_AS)
+    # Workers do not run app.py, the mapped datasets rely on Copy-on-Write like the Streamlit process
+    pd.set_option('mode.copy_on_write', True)
+    datasets = OrderedDict()
+    kernels = OrderedDict()
+    
+    while True:
+        try:
+            request = pickle.loads(connection.recv_bytes())
+        except EOFError:
+            break
+        
+        session_id = request['session_id']
+        if request['type'] == 'release':
+            kernels.pop(session_id, None)
+            continue
+        
+        # Mapping the datasets is not limited, only the generated code is, see below
+        resource.setrlimit(resource.RLIMIT_AS, (hard_memory_limit, hard_memory_limit))
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_start = rusage.ru_utime + rusage.ru_stime
+        reset_peak_memory()
+        blocks_start = sys.getallocatedblocks()
+        wall_start = time.perf_counter()
+        
+        variables = None
+        kernel = None
+        evicted_session_id = None
+        try:
+            # Map each dataset once per worker and keep the most recently used ones. The
+            # string columns wrap the mapped pages without copying, so every worker shares
+            # the same page cache instead of holding its own copy of the text
+            vetted_files = {}
+            for filename, path in request['dataset_paths'].items():
+                dtypes = request['dataset_dtypes'][filename]
+                if path not in datasets or not datasets[path].dtypes.equals(dtypes):
+                    datasets[path] = load_published_dataset(path, dtypes)
+                    if len(datasets) > SANDBOX_WORKER_DATASETS:
+                        datasets.popitem(last=False)
+                datasets.move_to_end(path)
+                vetted_files[filename] = {'dataframe': datasets[path]}
+            
+            safe_globals = create_safe_execution_environment(vetted_files)
+            if session_id is None:
+                globals_dict = safe_globals
+            else:
+                kernel, evicted_session_id = get_session_kernel(kernels, session_id)
+                globals_dict = kernel.prepare(safe_globals)
+            
+            # Only count the memory and objects the code itself allocates, not the datasets just
+            # loaded, so a large mapped dataset does not leave the code without headroom
+            limit = address_space() + memory_limit
+            if hard_memory_limit != resource.RLIM_INFINITY:
+                limit = min(limit, hard_memory_limit)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, hard_memory_limit))
+            blocks_start = sys.getallocatedblocks()
+            try:
+                response = ('ok', run_code(request['code'], globals_dict, request['report_function']))
+            finally:
+                if kernel is not None:
+                    variables = kernel.update(safe_globals, request['code'])
+        except Exception as e:
+            response = ('error', (e, traceback.format_exc()))
+        
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        usage = {
+            'wall_seconds': time.perf_counter() - wall_start,
+            'cpu_seconds': rusage.ru_utime + rusage.ru_stime - cpu_start,
+            'peak_memory_bytes': peak_memory(),
+            'allocated_blocks': sys.getallocatedblocks() - blocks_start,
+        }
+        try:
+            payload = pickle.dumps(response)
+            usage['result_bytes'] = len(payload)
+            check_resource_usage(usage, limit_objects=kernel is None)
+        except ResourceLimitError as e:
+            payload = pickle.dumps(('error', (e, '')))
+        except Exception as e:
+            error = RuntimeError(f"The result could not be returned from the sandbox: {str(e)}")
+            payload = pickle.dumps(('error', (error, '')))
+        connection.send_bytes(pickle.dumps((payload, variables, evicted_session_id, usage)))
+        plt.close('all')
+
+class SandboxPool:
+    """
+    Pool of pre-forked, warm worker processes for executing generated code.
+    
+    Workers are forked from a forkserver that has already imported this module
+    (and so pandas, numpy, matplotlib, plotly and statsmodels). A worker that
+    times out or hits its resource limits is killed and replaced. Sessions stick
+    to the worker that holds their namespace; a session that loses its worker,
+    to eviction or a replacement, has its variables forgotten, see
+    forget_session_variables.
+    """
+    
+    def __init__(self, size=SANDBOX_WORKERS):
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(['utils.security_helpers'])
+        self.workers = []
+        self.idle = []
+        self.affinity = OrderedDict()
+        # Sessions evicted from the affinity, whose namespaces are released once their worker is free
+        self.pending_releases = {}
+        self.condition = threading.Condition()
+        for _ in range(size):
+            self.idle.append(self._start_worker())
+    
+    def _start_worker(self):
+        parent_connection, child_connection = self.context.Pipe()
+        process = self.context.Process(
+            target=sandbox_worker,
+            args=(child_connection, SANDBOX_MEMORY_LIMIT),
+            daemon=True
+        )
+        process.start()
+        child_connection.close()
+        self.workers.append(process)
+        return process, parent_connection
+    
+    def _acquire(self, session_id):
+        """Take the session's worker, or any idle worker, waiting until it is free."""
+        with self.condition:
+            while True:
+                process = self.affinity.get(session_id)
+                for index, worker in enumerate(self.idle):
+                    if process is None or worker[0] is process:
+                        if session_id is not None:
+                            self.affinity[session_id] = worker[0]
+                            self.affinity.move_to_end(session_id)
+                            if len(self.affinity) > SANDBOX_WORKERS * SESSION_KERNELS_PER_PROCESS:
+                                evicted_session_id, evicted_process = self.affinity.popitem(last=False)
+                                forget_session_variables(evicted_session_id)
+                                self.pending_releases.setdefault(evicted_process, []).append(evicted_session_id)
+                        # Drop namespaces whose sessions can no longer find this worker, so a later
+                        # call cannot pick up stale variables the model was told are gone
+                        for released_session_id in self.pending_releases.pop(worker[0], []):
+                            worker[1].send_bytes(pickle.dumps({'type': 'release', 'session_id': released_session_id}))
+                        return self.idle.pop(index)
+                self.condition.wait()
+    
+    def _release(self, worker):
+        with self.condition:
+            self.idle.append(worker)
+            self.condition.notify_all()
+    
+    def _replace_worker(self, process, connection):
+        process.kill()
+        process.join()
+        connection.close()
+        with self.condition:
+            self.workers.remove(process)
+            self.pending_releases.pop(process, None)
+            # The namespaces of the sessions on this worker are gone with it
+            for session_id in [session_id for session_id, worker in self.affinity.items() if worker is process]:
+                del self.affinity[session_id]
+                forget_session_variables(session_id)
+        self._release(self._start_worker())
+    
+    def execute(self, code, report_function, dataset_paths, dataset_dtypes, timeout_sec=10, session_id=None):
+        """
+        Execute code on an idle worker, in the session's namespace if session_id is given.
+        
+        dataset_paths and dataset_dtypes map each dataset name to its published
+        file and to the dtypes of its vetted dataframe.
+        
+        Returns:
+            tuple: (result, stdout_output, variables)
+            
+        Raises:
+            TimeoutError: If code execution exceeds the timeout
+            ResourceLimitError: If code execution exceeds a resource limit
+            Exception: Any exception raised during code execution
+        """
+        process, connection = self._acquire(session_id)
+        request = {
+            'type': 'execute',
+            'code': code,
+            'report_function': report_function,
+            'dataset_paths': dataset_paths,
+            'dataset_dtypes': dataset_dtypes,
+            'session_id': session_id
+        }
+        try:
+            connection.send_bytes(pickle.dumps(request))
+            finished = connection.poll(timeout_sec)
+            if finished:
+                response, variables, evicted_session_id, usage = pickle.loads(connection.recv_bytes())
+        except (EOFError, OSError):
+            # The worker was killed by the kernel, most likely by the out-of-memory killer
+            self._replace_worker(process, connection)
+            raise ResourceLimitError(f"Code execution was terminated, most likely for running out of memory. Reduce the data before expensive operations, e.g. filter or aggregate before merging and avoid cross joins.")
+        
+        if not finished:
+            # Unlike a thread, the worker can actually be stopped
+            self._replace_worker(process, connection)
+            raise TimeoutError(f"Code execution timed out after {timeout_sec} seconds.")
+        
+        if evicted_session_id is not None:
+            with self.condition:
+                # A session that has since moved to another worker keeps its variables there
+                evicted = self.affinity.get(evicted_session_id) is process
+                if evicted:
+                    del self.affinity[evicted_session_id]
+            if evicted:
+                forget_session_variables(evicted_session_id)
+        self._release((process, connection))
+        log_resource_usage(usage)
+        if session_id is not None:
+            session_variables[session_id] = variables
+        status, payload = pickle.loads(response)
+        if status == 'error':
+            error, worker_traceback = payload
+            error.sandbox_traceback = worker_traceback
+            raise error
+        return payload
+    
+    def release_session(self, session_id):
+        """Drop the namespace of a session from its worker."""
+        with self.condition:
+            if session_id not in self.affinity:
+                return
+        process, connection = self._acquire(session_id)
+        with self.condition:
+            self.affinity.pop(session_id, None)
+        connection.send_bytes(pickle.dumps({'type': 'release', 'session_id': session_id}))
+        self._release((process, connection))
+    
+    def shutdown(self):
+        for process in self.workers:
+            process.kill()
+
+sandbox_pool = None
+sandbox_pool_lock = threading.Lock()
+published_datasets = OrderedDict()
+published_datasets_lock = threading.Lock()
+
+# Namespaces of the thread backend, and the variables each session has kept
+session_kernels = OrderedDict()
+session_kernels_lock = threading.Lock()
+session_variables = {}
+
+# Names of the variables each session lost with its namespace, until the model is told
+lost_session_variables = {}
+
+def get_sandbox_pool():
+    """Return the process-wide sandbox pool, starting it on first use."""
+    global sandbox_pool
+    with sandbox_pool_lock:
+        if sandbox_pool is None:
+            sandbox_pool = SandboxPool()
+            atexit.register(sandbox_pool.shutdown)
+        return sandbox_pool
+
+def publish_dataset(vetted_file):
+    """
+    Write a vetted dataframe to an Arrow IPC file the workers can memory-map.
+    
+    Files are keyed by the dataset fingerprint, so each dataset is written once
+    and the operating system shares its pages between all workers. The file is
+    written outside the lock, so other sessions are not held up by a large write.
+    A streamed upload whose dtypes were not changed in the data dictionary is
+    already an Arrow IPC file, which is hard-linked instead of written again.
+    
+    Returns:
+        str: The path of the published file
+    """
+    path = os.path.join(SANDBOX_DATASET_DIR, f'{vetted_file["fingerprint"]}.arrow')
+    with published_datasets_lock:
+        if path in published_datasets and os.path.exists(path):
+            published_datasets.move_to_end(path)
+            return path
+    
+    os.makedirs(SANDBOX_DATASET_DIR, exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    linked = False
+    if 'dataframe_path' in vetted_file and vetted_file['dataframe'].dtypes.equals(vetted_file['data_types']):
+        try:
+            # The link keeps the file when the dataset cache removes the store
+            os.link(vetted_file['dataframe_path'], temporary_path)
+            linked = True
+        except OSError as e:
+            logging.warning(f'Could not link {vetted_file["dataframe_path"]}, writing a copy: {str(e)}')
+    if not linked:
+        table = pa.Table.from_pandas(vetted_file['dataframe'])
+        with pa.ipc.new_file(temporary_path, table.schema) as writer:
+            writer.write_table(table)
+    
+    with published_datasets_lock:
+        # Workers that mapped an earlier copy keep reading it, the rename does not touch it
+        os.replace(temporary_path, path)
+        published_datasets[path] = os.path.getsize(path)
+        published_datasets.move_to_end(path)
+        
+        while sum(published_datasets.values()) > SANDBOX_DATASET_BUDGET and len(published_datasets) > 1:
+            evicted_path, _ = published_datasets.popitem(last=False)
+            if os.path.exists(evicted_path):
+                os.remove(evicted_path)
+        return path
+
+def execute_in_sandbox_process(code, vetted_files, report_function, timeout_sec=10, session_id=None):
+    """
+    Execute code in a sandbox worker process with a hard timeout.
+    
+    Returns:
+        tuple: (result, stdout_output)
+    """
+    dataset_paths = {filename: publish_dataset(vetted_files[filename]) for filename in vetted_files}
+    dataset_dtypes = {filename: vetted_files[filename]['dataframe'].dtypes for filename in vetted_files}
+    return get_sandbox_pool().execute(code, report_function, dataset_paths, dataset_dtypes, timeout_sec, session_id)
+
+def get_session_variables(session_id):
+    """
+    Return the variables a session has kept from earlier tool calls.
+    
+    Returns:
+        list: One-line descriptions of the variables
+    """
+    return list((session_variables.get(session_id) or {}).values())
+
+def forget_session_variables(session_id):
+    """Record that a session's namespace was dropped, so its variables are no longer offered to the model."""
+    variables = session_variables.pop(session_id, None)
+    if variables:
+        logging.info(f"Session {session_id} lost its variables {', '.join(variables)}")
+        lost_session_variables[session_id] = sorted(set(lost_session_variables.get(session_id, [])) | set(variables))
+
+def pop_lost_session_variables(session_id):
+    """
+    Return the variables a session lost since this was last called.
+    
+    Returns:
+        list: Names of the variables that no longer exist
+    """
+    return lost_session_variables.pop(session_id, [])
+
+def uses_session_namespace(python_syntax, report_function, session_id):
+    """
+    Check whether a snippet reads or writes the variables kept in a session's namespace.
+    
+    Snippets that do not touch it behave the same in a fresh namespace, so they can run
+    on any idle worker in parallel with the session's other tool calls.
+    """
+    compiled = compile_code(python_syntax)
+    if compiled['stores'] - {report_function}:
+        return True
+    return bool(compiled['names'] & set(session_variables.get(session_id) or {}))
+
+def release_session_kernel(session_id):
+    """Drop the namespace a session has built up, e.g. when it is reset."""
+    session_variables.pop(session_id, None)
+    lost_session_variables.pop(session_id, None)
+    with session_kernels_lock:
+        session_kernels.pop(session_id, None)
+    if sandbox_pool is not None:
+        sandbox_pool.release_session(session_id)
+
+def safely_execute_code(python_syntax, vetted_files, report_function, session_id=None):
     """
     Safely execute Python code with security validation and timeout.
     
@@ -197,6 +902,7 @@ def safely_execute_code(python_syntax, vetted_files, report_function):
         python_syntax (str): The Python code to execute
         vetted_files (dict): Dictionary of vetted files with their dataframes
         report_function (str): The name of the function to call for results
+        session_id (str): Run in this session's persistent namespace, see get_session_variables
         
     Returns:
         tuple: (output, stdout_output, error_message)
@@ -209,11 +915,29 @@ def safely_execute_code(python_syntax, vetted_files, report_function):
         # Validate code security
         validate_code_security(python_syntax)
         
-        # Create safe execution environment
-        safe_globals = create_safe_execution_environment(vetted_files)
+        if session_id is not None and not uses_session_namespace(python_syntax, report_function, session_id):
+            # Independent snippets do not need to wait for the worker holding the session's namespace
+            session_id = None
         
-        # Execute the code with timeout and security restrictions
-        output, stdout_output = execute_with_timeout(python_syntax, safe_globals, report_function)
+        if SANDBOX_BACKEND == 'process':
+            # Execute the code in a worker process that is killed on timeout
+            output, stdout_output = execute_in_sandbox_process(python_syntax, vetted_files, report_function, session_id=session_id)
+        else:
+            # Create safe execution environment
+            safe_globals = create_safe_execution_environment(vetted_files)
+            
+            if session_id is None:
+                # Execute the code with timeout and security restrictions
+                output, stdout_output = execute_with_timeout(python_syntax, safe_globals, report_function)
+            else:
+                with session_kernels_lock:
+                    kernel, evicted_session_id = get_session_kernel(session_kernels, session_id)
+                if evicted_session_id is not None:
+                    forget_session_variables(evicted_session_id)
+                try:
+                    output, stdout_output = execute_with_timeout(python_syntax, kernel.prepare(safe_globals), report_function, limit_objects=False)
+                finally:
+                    session_variables[session_id] = kernel.update(safe_globals, python_syntax)
         
     except TimeoutError as e:
         error_message = str(e)
@@ -221,9 +945,16 @@ def safely_execute_code(python_syntax, vetted_files, report_function):
     except SecurityError as e:
         error_message = f"Security violation: {str(e)}"
         logging.error(f"Security violation in code execution: {str(e)}")
+    except ResourceLimitError as e:
+        error_message = str(e)
+        logging.error(f"Code execution exceeded the sandbox limits: {error_message}")
+    except MemoryError as e:
+        memory_limit = f" The sandbox allows {format_bytes(SANDBOX_MEMORY_LIMIT)} on top of the loaded datasets." if SANDBOX_BACKEND == 'process' else ""
+        error_message = f"Code execution ran out of memory ({str(e)}).{memory_limit} Reduce the data before expensive operations, e.g. filter or aggregate before merging and avoid cross joins."
+        logging.error(f"Code execution exceeded the sandbox limits: {error_message}")
     except Exception as e:
-        # Log the full traceback for debugging purposes
-        full_traceback = traceback.format_exc()
+        # Log the full traceback for debugging purposes, from the worker process if the code ran there
+        full_traceback = getattr(e, 'sandbox_traceback', None) or traceback.format_exc()
         logging.error(f"Error in code execution: {full_traceback}")
         
         # Provide a clean error message to the user with exception type and message,
@@ -5,6 +5,11 @@ import json
 import pandas as pd  # Add import for pandas
 import matplotlib.figure as mfigure  # Add import for matplotlib.figure
 
+from utils.security_helpers import release_session_kernel
+from utils.plot_helpers import get_ui_image
+from utils.artifact_helpers import is_artifact
+from utils.result_helpers import decode_result, SESSION_VARIABLES_HEADER, RESULT_NOTES_HEADER
+
 def setup_session_state():
     logging.info(f'###############################')
     logging.info(f'setup_session_state')
@@ -15,6 +20,8 @@ def setup_session_state():
 
 def reset_app():
     logging.info(f'reset_app - {st.session_state["session_id"]}')
+    # Drop the variables the agent kept in the sandbox
+    release_session_kernel(st.session_state['session_id'])
     # Clear all keys in st.session_state
     for key in list(st.session_state.keys()):
         del st.session_state[key]
@@ -31,11 +38,12 @@ def goto_data_dictionary_widget():
 def goto_data_analysis_widget():
     logging.info(f'goto_data_analysis_widget - {st.session_state["session_id"]}')
     st.session_state['datasets_vetted'] = True
-    if 'uploaded_files' in st.session_state.keys():
-        del st.session_state['uploaded_files']
+    if 'ingested_files' in st.session_state.keys():
+        del st.session_state['ingested_files']
 
 def reset_data_analyst():
     logging.info(f'reset_data_analyst - {st.session_state["session_id"]}')
+    release_session_kernel(st.session_state['session_id'])
     st.session_state['messages'] = []
     st.session_state['count'] = 0
     st.session_state['cost'] = 0
@@ -54,12 +62,16 @@ def render_reset_data_analyst():
 
 def reset_analytics_agent():
     logging.info(f'reset_analytics_agent - {st.session_state["session_id"]}')
+    release_session_kernel(st.session_state['session_id'])
     st.session_state['messages'] = []
     st.session_state['count'] = 0
     st.session_state['cost'] = 0
     st.session_state['show_sample'] = True
     st.session_state['disable_sample_button'] = False
     st.session_state['context_window_usage'] = 0
+    st.session_state['input_tokens'] = 0
+    st.session_state['cached_tokens'] = 0
+    st.session_state['compaction'] = None
     st.session_state['session_id'] = str(uuid.uuid4())
     print('###############################')
     print('reset_analytics_agent')
@@ -130,12 +142,30 @@ def render_tool_response(tool_response):
     Args:
         tool_response: The tool response to render
     """
-    if tool_response.startswith('data:image/png;base64,'):
+    if is_artifact(tool_response):
         with st.expander('🛠️ See Tool Response - Plot', expanded=True):
-            st.image(tool_response)
+            # The model sees a downscaled copy, show the full-resolution image
+            image = get_ui_image(tool_response)
+            if image is None:
+                st.caption('This plot is no longer available.')
+            else:
+                st.image(image)
     
     else:
         with st.expander('🛠️ See Tool Response', expanded=False):
+            tool_response, _, variables = tool_response.partition(SESSION_VARIABLES_HEADER)
+            if variables:
+                st.caption(f"Variables available to later tool calls: {', '.join(variables.splitlines())}")
+            tool_response, _, notes = tool_response.partition(RESULT_NOTES_HEADER)
+            if notes:
+                st.caption(f"Result shortened to fit the token budget: {notes}")
+
+            # Tabular results are sent as CSV/TSV, split JSON or markdown, whichever is shortest
+            df = decode_result(tool_response)
+            if df is not None:
+                st.dataframe(df, width='stretch')
+                return
+
             try:
                 # Try parsing the response
                 data = json.loads(tool_response)
@@ -1,5 +1,6 @@
 import streamlit as st
 import logging
+import hashlib
 
 generate_explanation_system_message = """You are an automated system that explains the computer code inputted by the user.
 You must explain the code in a way that is easy to understand for a non-technical audience.
@@ -105,27 +106,42 @@ def add_file_metadata(system_message, vetted_files):
     """Add metadata for each file to the system message."""
     system_message += "Here is the metadata of the files uploaded by the user.\n"
     for filename in vetted_files:
+        # Statistics come from the profile computed once per dataset
+        profile = vetted_files[filename]['profile']
         system_message += f'\n\n{filename}:\n\n'
-        system_message += f'Shape: {vetted_files[filename]["dataframe"].shape}\n\n'
+        system_message += f'Shape: {profile.shape}\n\n'
         system_message += f'Description: {vetted_files[filename]["dataset_description"]}\n\n'
         system_message += f'Data Dictionary:\n\n'
         system_message += vetted_files[filename]['data_dictionary_json']+'\n\n'
         system_message += f'Pandas Describe:\n\n'
-        system_message += vetted_files[filename]['dataframe'].describe(include='all').T.to_json(orient='index')+'\n\n'
+        system_message += vetted_files[filename]['pandas_describe'].T.to_json(orient='index')+'\n\n'
         system_message += f'Missing Values by Column:\n\n'
-        missing_values = vetted_files[filename]["dataframe"].isna().sum().to_json()
+        missing_values = profile.missing_values().to_json()
         system_message += missing_values + '\n\n'
         system_message += f'First 5 rows of the dataset:\n\n'
-        system_message += vetted_files[filename]['dataframe'].head().to_json(orient='index')+'\n\n'
+        system_message += profile.head.to_json(orient='index')+'\n\n'
         system_message += f'Last 5 rows of the dataset:\n\n'
-        system_message += vetted_files[filename]['dataframe'].tail().to_json(orient='index')+'\n\n'
+        system_message += profile.tail.to_json(orient='index')+'\n\n'
         system_message += f'The dataset has already been loaded as a pandas DataFrame named {filename}\n\n'
     
     system_message += "You must use this metadata to generate your response.\n"
     return system_message
+def get_system_message_key(vetted_files, agent_model):
+    """Key the system message on the dataset fingerprints and the data dictionary version."""
+    key = [str(agent_model)]
+    for filename in vetted_files:
+        data_dictionary = f'{vetted_files[filename]["dataset_description"]}\n{vetted_files[filename]["data_dictionary_json"]}'
+        key.append(f'{filename}:{vetted_files[filename]["fingerprint"]}:{hashlib.sha256(data_dictionary.encode()).hexdigest()}')
+    return '|'.join(key)
+
 def construct_system_message(vetted_files, agent_model):
     """Construct the system message based on the model and available files."""
     logging.info(f'construct_system_message - {st.session_state["session_id"]}')
+
+    # Reuse the system message across reruns and turns while the datasets are unchanged
+    key = get_system_message_key(vetted_files, agent_model)
+    if 'system_message_cache' in st.session_state and key in st.session_state['system_message_cache']:
+        return st.session_state['system_message_cache'][key]
     
     system_message = get_base_system_message(agent_model)
     
@@ -133,5 +149,7 @@ def construct_system_message(vetted_files, agent_model):
         system_message = add_code_snippet_instructions(system_message, vetted_files)
     
     system_message = add_file_metadata(system_message, vetted_files)
+
+    st.session_state['system_message_cache'] = {key: system_message}
     
     return system_message
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import tiktoken
+
+# Characters encoded at a time when counting tokens against a limit
+TOKEN_COUNT_CHUNK = 16 * 1024
+
+# Number of message token counts kept, shared by all sessions
+TOKEN_CACHE_SIZE = 4096
+
+encoding = tiktoken.encoding_for_model('gpt-4')
+
+
+def byte_length(text):
+    """UTF-8 length of a text, an upper bound of its token count as every token is at least one byte."""
+    # isascii is a flag check, so ASCII text is never copied
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def estimate_tokens(text):
+    """Rough token count of a text for logging, about four bytes per token."""
+    return (byte_length(text) + 3) // 4
+
+
+def count_tokens(text, limit=None):
+    """
+    Count the tokens of a text, stopping once limit is exceeded.
+
+    The text is encoded a chunk at a time, so a huge text costs no more than
+    its first limit tokens. Counts across chunk boundaries can be off by a
+    token or two, which does not matter against a budget.
+
+    Args:
+        text (str): The text to count
+        limit (int): Stop counting once the count exceeds this, None counts everything
+
+    Returns:
+        int: The token count, or a count above limit if the text exceeds it
+    """
+    if limit is None or len(text) <= TOKEN_COUNT_CHUNK:
+        return len(encoding.encode(text))
+    tokens = 0
+    start = 0
+    while start < len(text) and tokens <= limit:
+        # Cut at a line break where there is one, so few tokens straddle the cut
+        end = text.find('\n', start + TOKEN_COUNT_CHUNK, start + 2 * TOKEN_COUNT_CHUNK)
+        end = min(start + TOKEN_COUNT_CHUNK, len(text)) if end == -1 else end + 1
+        tokens += len(encoding.encode(text[start:end]))
+        start = end
+    return tokens
+
+
+def within_limit(text, limit):
+    """
+    Check that a text has fewer than limit tokens.
+
+    Texts shorter than limit bytes cannot reach it and are never encoded;
+    longer ones are counted exactly, up to the limit.
+    """
+    if byte_length(text) < limit:
+        return True
+    return count_tokens(text, limit) < limit
+
+
+def format_message(message):
+    """The text of a chat message that is counted, the role and content or tool calls."""
+    if 'content' in message:
+        return f"role: {message['role']}, message: {message['content']}\n"
+    text = ''
+    for tool_call in message.get('tool_calls', []):
+        text = f"{text}role: {message['role']}, tool_call: {tool_call['function']['name']}, arguments: {tool_call['function']['arguments']}\n"
+    return text
+
+
+class TokenCounter:
+    """
+    Process-wide token counts of conversation messages.
+
+    Messages carry no stable id, so the hash of their text is used as one.
+    Every turn resends the whole conversation, but only the messages added
+    since the last turn are encoded; the others are looked up.
+    """
+
+    def __init__(self, size=TOKEN_CACHE_SIZE):
+        self.size = size
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def message_tokens(self, message):
+        """Return the token count of a message, encoding it only the first time it is seen."""
+        text = format_message(message)
+        if byte_length(text) < 64:
+            # Hashing short texts costs about as much as encoding them
+            return count_tokens(text)
+        message_id = hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+        with self.lock:
+            if message_id in self.counts:
+                self.counts.move_to_end(message_id)
+                return self.counts[message_id]
+        tokens = count_tokens(text)
+        with self.lock:
+            self.counts[message_id] = tokens
+            if len(self.counts) > self.size:
+                self.counts.popitem(last=False)
+        return tokens
+
+    def conversation_tokens(self, messages, limit=None):
+        """
+        Return the token count of a conversation.
+
+        Args:
+            messages (list): Chat messages with a role and content or tool calls
+            limit (int): Stop adding up once the total exceeds this, None counts everything
+
+        Returns:
+            int: The token count, or a count above limit if the conversation exceeds it
+        """
+        total = 0
+        for message in messages:
+            total += self.message_tokens(message)
+            if limit is not None and total > limit:
+                break
+        return total
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,55 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils import security_helpers
+
+# Threads running tool calls, shared by all sessions. Sandboxed code still
+# runs on the sandbox workers, these threads mostly wait for them.
+TOOL_CALL_THREADS = 16
+
+tool_call_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_THREADS, thread_name_prefix='tool_call')
+
+
+def dispatch_tool_calls(tool_calls, run_tool_call, on_result):
+    """
+    Run the tool calls of one model response concurrently.
+
+    The model only issues calls together when they do not depend on each
+    other, so they run in parallel on the tool call threads. Each result is
+    handed to on_result in the script thread as soon as it finishes, so the UI
+    can show it straight away, while the returned results keep the order of
+    tool_calls (and so of their call ids).
+
+    Args:
+        tool_calls (list): The tool calls of the model response
+        run_tool_call (callable): Runs one tool call and returns its result, must not raise
+        on_result (callable): Called with (tool_call, result) as each call finishes
+
+    Returns:
+        list: The results, in the order of tool_calls
+    """
+    if len(tool_calls) == 1 or security_helpers.SANDBOX_BACKEND != 'process':
+        # The thread backend redirects the stdout of the whole process, so its calls cannot overlap
+        results = []
+        for tool_call in tool_calls:
+            results.append(run_tool_call(tool_call))
+            on_result(tool_call, results[-1])
+        return results
+
+    logging.info(f'Dispatching {len(tool_calls)} tool calls in parallel')
+    # The tool call threads need the session's script context to read st.session_state
+    script_run_ctx = get_script_run_ctx()
+
+    def run_with_context(tool_call):
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+        return run_tool_call(tool_call)
+
+    futures = {tool_call_executor.submit(run_with_context, tool_call): index for index, tool_call in enumerate(tool_calls)}
+    results = [None] * len(tool_calls)
+    for future in as_completed(futures):
+        index = futures[future]
+        results[index] = future.result()
+        on_result(tool_calls[index], results[index])
+    return results
@@ -1,25 +1,17 @@
 import streamlit as st
 import logging
 import uuid
-import time
 import json
 import pandas as pd
 
 from utils.ai_helpers import construct_welcome_message, generate_ai_response
 from utils.system_messages import construct_system_message
+from utils.compaction_helpers import COMPACTION_THRESHOLD
 
 from widgets.prompt_guide import render_analytics_agent_prompt_guide
 from utils.streamlit_helpers import render_ai_prompt, safely_escape_dollars, render_tool_call, render_tool_response, disable_sample_button
 
 
-def stream_text(text):
-    for paragraph in text.split('\n'):
-        for word in paragraph.split():
-            yield word + " "
-            time.sleep(0.05)
-        yield "\n"
-        
-            
 def render_analytics_agent():
     logging.info(f'render_analytics_agent - {st.session_state["session_id"]}')
     st.divider()
@@ -76,12 +68,19 @@ def render_analytics_agent():
     if 'context_window_usage' not in st.session_state:
         st.session_state['context_window_usage'] = 0
 
+    if 'input_tokens' not in st.session_state:
+        st.session_state['input_tokens'] = 0
+
+    if 'cached_tokens' not in st.session_state:
+        st.session_state['cached_tokens'] = 0
+
     st.session_state['usage_container'] = st.empty()
 
     with st.session_state['usage_container']:
         st.sidebar.metric(
             label='Usage in this session',
             value=f'${st.session_state["cost"]}',
+            help=f'{st.session_state["cached_tokens"]:,} of {st.session_state["input_tokens"]:,} input tokens were served from the prompt cache at a discount.',
         )
 
     render_analytics_agent_prompt_guide()
@@ -133,8 +132,8 @@ def render_analytics_agent():
             text=f'Model Context Usage: {st.session_state["context_window_usage"]*100:.2f}%'
         )
 
-    if st.session_state['context_window_usage'] > 0.5:
-        st.warning('LLMs are known to degrade in performance when context window usage gets higher than 50%. Consider starting a new session.')
+    if st.session_state['context_window_usage'] > COMPACTION_THRESHOLD:
+        st.info('The conversation is getting long. Earlier turns will be summarized for the model before your next question, they stay visible here.')
 
 
     st.session_state['user_input'] = st.chat_input(
@@ -181,5 +180,5 @@ def render_analytics_agent():
                 st.chat_message('user').write(safely_escape_dollars(st.session_state['user_input']))  # Safely escape dollar signs for LaTeX rendering
             st.session_state['messages'] = generate_ai_response(st.session_state['vetted_files'], st.session_state['model'], True)
             st.session_state['count'] += 1
-        st.chat_message('assistant').write_stream(stream_text(safely_escape_dollars(st.session_state['messages'][-1]['content'][0]['text'])))  # Safely escape dollar signs for LaTeX rendering
+        # The answer was streamed into the page as it was generated
         st.rerun()
\ No newline at end of file
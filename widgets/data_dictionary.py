@@ -34,6 +34,12 @@ def render_data_dictionary_widget():
         df = df[['Primary Key', 'Column Name', 'Data Type', 'Description']]
 
         st.subheader(f':blue[{filename}]')
+        if 'ingestion_stats' in st.session_state['vetted_files'][filename]:
+            ingestion_stats = st.session_state['vetted_files'][filename]['ingestion_stats']
+            storage = 'on disk' if 'dataframe_path' in st.session_state['vetted_files'][filename] else 'of memory'
+            st.caption(f"Parsed with the {ingestion_stats['engine']} engine in {ingestion_stats['parse_seconds']:.2f}s, using {ingestion_stats['memory_bytes'] / 1024 / 1024:.1f}MB {storage}")
+        if st.session_state['vetted_files'][filename]['primary_key']:
+            st.caption(f"Detected primary key: {', '.join(map(str, st.session_state['vetted_files'][filename]['primary_key']))}")
         with st.expander('See uploaded Dataset'):
             data_filter = st.selectbox(
                 label = 'Select the number of rows to display',